@@ -0,0 +1,66 @@
+"""
+On-disk store of finished chord analyses, one JSON file per song
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import tempfile
+
+DATA_DIR = os.environ.get(
+    'DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+)
+
+_UNSAFE_KEY_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+class AnalysisStore:
+    """Stored analysis records keyed by video ID (or any other safe song key)"""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, _UNSAFE_KEY_CHARS.sub('_', key) + '.json')
+
+    def get(self, key):
+        """Return the stored record for key, or None"""
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def version(self, key):
+        """Cheap change marker for a stored record (file mtime), or None if absent"""
+        try:
+            return os.stat(self._path(key)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, record):
+        """Write a record atomically so readers never see a half-written file"""
+        record = dict(record, store_key=key, stored_at=time.time())
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            with self._lock:
+                os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return record
+
+    def iter_records(self):
+        """Yield every stored record"""
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith('.json'):
+                record = self.get(name[:-len('.json')])
+                if record is not None:
+                    yield record
@@ -9,9 +9,25 @@ import requests
 import random
 import time
 import socket
-from flask import Flask, jsonify, request
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import Flask, jsonify, request, send_file
 from flask_cors import CORS
 
+from analysis_store import AnalysisStore, DATA_DIR
+from audio_sources import AudioSource, FakeAudioSource, SkipDownload, extract_video_id
+from audio_upload import UPLOAD_TRANSFER_SECONDS, UploadError, receive_upload
+from chord_timeline import ChordTimeline, TimelineCache
+from fingerprint_index import FingerprintIndex, FingerprintStore, compute_fingerprint, verify_alignment
+from progression_index import ProgressionIndex
+from song_catalog import SongCatalog, catalog_key, entry_chords
+from reanalysis import REANALYSIS_ENABLED, PopularityCounter, ReanalysisScheduler
+from request_profiler import ProfileStore, profile_request, profiling_token_valid, should_profile
+from request_control import (
+    AnalysisCancelled, AnalysisDeadline, AdmissionController, Overloaded,
+    client_disconnect_probe, request_deadline_seconds
+)
+
 app = Flask(__name__)
 
 # Clean CORS setup - no duplicates
@@ -20,6 +36,40 @@ CORS(app, origins="*")
 # Path to the web-build directory
 WEB_BUILD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web-build')
 
+# Analysis tuning (MAX_ANALYSIS_SECONDS=0 removes the length cap)
+MAX_ANALYSIS_SECONDS = float(os.environ.get('MAX_ANALYSIS_SECONDS', 120))
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 1))
+PARALLEL_MIN_SECONDS = float(os.environ.get('PARALLEL_MIN_SECONDS', 90))
+# FINGERPRINT_MATCHING=0 always runs the full analysis (load tests of the analysis path)
+FINGERPRINT_MATCHING = os.environ.get('FINGERPRINT_MATCHING', '1') == '1'
+
+# Preview tier: a cheap pass over the opening seconds answers first, the full pass follows
+PREVIEW_SECONDS = float(os.environ.get('PREVIEW_SECONDS', 25))
+# Latency budget of a preview request: extraction, the opening-seconds download and the pass
+PREVIEW_DEADLINE_SECONDS = float(os.environ.get('PREVIEW_DEADLINE_SECONDS', 20))
+REFINE_DEADLINE_SECONDS = float(os.environ.get('REFINE_DEADLINE_SECONDS', 600))
+
+# Bump whenever extract_chords_from_audio changes; older stored results are not reused
+ANALYZER_VERSION = 1
+
+# Finished analyses, plus a fingerprint index to recognize re-uploads of stored songs
+# and a progression index for similar-song search. Fingerprints are kept out of the
+# analysis records so reading a record stays cheap
+analysis_store = AnalysisStore(os.path.join(DATA_DIR, 'analyses'))
+fingerprint_store = FingerprintStore(os.path.join(DATA_DIR, 'fingerprints'))
+fingerprint_index = FingerprintIndex()
+progression_index = ProgressionIndex()
+timeline_cache = TimelineCache(analysis_store)
+
+# Caps concurrent analyses and sheds load the queue could not serve in time
+admission = AdmissionController()
+
+# Request counts per song, used to order background re-analysis
+popularity = PopularityCounter(os.path.join(DATA_DIR, 'popularity.json'))
+
+# Sampled or explicitly requested pipeline profiles
+profile_store = ProfileStore()
+
 def check_ffmpeg():
     """Check if FFmpeg is available"""
     try:
@@ -38,17 +88,27 @@ def check_ffmpeg():
         print(f"❌ FFmpeg check failed: {e}")
         return False
 
-def download_youtube_audio(youtube_url):
-    """Download audio from YouTube using yt-dlp with better error handling"""
+def download_youtube_audio(youtube_url, deadline=None, temp_dir=None, on_metadata=None, max_seconds=None):
+    """
+    Download audio from YouTube using yt-dlp with better error handling.
+    on_metadata(video_id, title, duration) runs between extraction and download
+    and may raise SkipDownload. max_seconds limits the download to the opening
+    seconds of the track.
+    """
     try:
         import yt_dlp
         
         print(f"🎵 Downloading audio from: {youtube_url}")
         
-        # Create temporary directory
-        temp_dir = tempfile.mkdtemp()
+        # Create temporary directory unless the caller owns one (and cleans it up)
+        temp_dir = temp_dir or tempfile.mkdtemp()
         print(f"📁 Temp directory: {temp_dir}")
         
+        # Abort a running download as soon as the request is no longer wanted
+        def check_deadline(_progress):
+            if deadline:
+                deadline.check('download')
+        
         # Simplified yt-dlp options that work better on Railway
         ydl_opts = {
             'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
@@ -67,13 +127,20 @@ def download_youtube_audio(youtube_url):
             'no_warnings': False,   # Show warnings for debugging
             'quiet': False,         # Show output for debugging
             'verbose': True,        # More verbose output
+            'progress_hooks': [check_deadline],
         }
+        if max_seconds:
+            # Range download: yt-dlp has ffmpeg fetch only the opening section
+            ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [(0, max_seconds)])
         
+        video_id = None
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             try:
                 # Get video info first
+                if deadline:
+                    deadline.check('extract')
                 info = ydl.extract_info(youtube_url, download=False)
-                video_id = info.get('id', 'unknown')
+                video_id = info.get('id')
                 title = info.get('title', 'Unknown Song')
                 duration = info.get('duration', 180)
                 
@@ -81,11 +148,21 @@ def download_youtube_audio(youtube_url):
                 print(f"⏱️ Duration: {duration}s")
                 print(f"🔍 Video ID: {video_id}")
                 
+                if on_metadata:
+                    on_metadata(video_id, title, duration)
+                
                 # Now download
+                if deadline:
+                    deadline.check('download')
                 print("🎵 Starting audio download...")
                 ydl.download([youtube_url])
                 
             except Exception as download_error:
+                # yt-dlp wraps exceptions from progress hooks; don't retry cancelled work
+                if isinstance(download_error, (AnalysisCancelled, SkipDownload)):
+                    raise
+                if deadline:
+                    deadline.check('download')
                 print(f"⚠️ Download failed: {download_error}")
                 
                 # Try with even simpler options as fallback
@@ -93,6 +170,7 @@ def download_youtube_audio(youtube_url):
                     'format': 'worst',  # Use worst quality as last resort
                     'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
                     'quiet': True,
+                    'progress_hooks': [check_deadline],
                 }
                 
                 print("🎵 Trying fallback download...")
@@ -128,7 +206,7 @@ def download_youtube_audio(youtube_url):
                 # Verify file exists and has content
                 if os.path.exists(audio_file) and os.path.getsize(audio_file) > 0:
                     print(f"✅ Audio file ready: {audio_file}")
-                    return audio_file, duration, title
+                    return audio_file, duration, title, video_id
                 else:
                     raise Exception(f"Audio file exists but is empty: {audio_file}")
             else:
@@ -141,121 +219,54 @@ def download_youtube_audio(youtube_url):
                 
                 raise Exception(f"No media file found. All files: {all_files}")
                 
+    except (AnalysisCancelled, SkipDownload):
+        raise
     except Exception as e:
+        if deadline:
+            deadline.check('download')
         print(f"❌ Audio download failed: {e}")
         raise Exception(f"Failed to download audio: {str(e)}")
 
-def extract_chords_from_audio(audio_path, duration):
-    """Extract chords from audio using librosa"""
+def extract_chords_from_audio(audio_path, duration, deadline=None):
+    """Extract chords from audio using librosa; raises if nothing usable was found"""
     try:
         import librosa
         import numpy as np
+        from chord_analysis import (
+            SAMPLE_RATE, FRAME_STEP, compute_chroma, score_frames, frames_to_chords, group_chords
+        )
         
         print(f"🎸 Analyzing chords from: {audio_path}")
         
-        # Load audio file (limit to 2 minutes for performance)
-        max_duration = min(duration, 120)  
-        y, sr = librosa.load(audio_path, sr=22050, mono=True, duration=max_duration)
+        if deadline:
+            deadline.check('decode')
         
-        print(f"🎵 Loaded {len(y)/sr:.1f}s of audio at {sr}Hz")
+        # Load audio file (MAX_ANALYSIS_SECONDS=0 analyzes the whole track)
+        max_duration = min(duration, MAX_ANALYSIS_SECONDS) if MAX_ANALYSIS_SECONDS > 0 else duration
+        y, sr = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True, duration=max_duration)
         
-        # Extract chroma features for chord detection
-        hop_length = 2048
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=hop_length)
-        times = librosa.frames_to_time(np.arange(chroma.shape[1]), sr=sr, hop_length=hop_length)
-        
-        print(f"🎸 Processing {chroma.shape[1]} chroma frames...")
-        
-        # Chord templates
-        chord_templates = {
-            'C': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
-            'C#': [0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0],
-            'D': [0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0],
-            'D#': [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0],
-            'E': [0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1],
-            'F': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
-            'F#': [0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0],
-            'G': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
-            'G#': [1, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0],
-            'A': [0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0],
-            'A#': [0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 0],
-            'B': [0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1],
-            'Am': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
-            'Em': [0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1],
-            'Dm': [0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 0],
-            'Bm': [0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1],
-            'F#m': [0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0],
-            'Gm': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
-            'Cm': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
-            'Fm': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0]
-        }
-        
-        # Detect chords using template matching
-        chords = []
-        frame_step = 8  # Process every 8th frame for stability
+        print(f"🎵 Loaded {len(y)/sr:.1f}s of audio at {sr}Hz")
         
-        for i in range(0, len(times), frame_step):
-            if i >= chroma.shape[1]:
-                break
-                
-            frame = chroma[:, i]
-            best_chord = 'C'
-            best_score = 0
-            
-            # Test against chord templates
-            for chord_name, template in list(chord_templates.items())[:25]:
-                try:
-                    template_norm = np.array(template[:12])
-                    if np.sum(template_norm) > 0:
-                        template_norm = template_norm / np.sum(template_norm)
-                        frame_norm = frame / (np.sum(frame) + 1e-8)
-                        score = np.dot(frame_norm, template_norm)
-                        if score > best_score:
-                            best_score = score
-                            best_chord = chord_name
-                except Exception:
-                    continue
-            
-            if i < len(times) and best_score > 0.3:  # Confidence threshold
-                chords.append({
-                    'chord': best_chord,
-                    'time': float(times[i]),
-                    'confidence': float(min(1.0, max(0.3, best_score)))
-                })
+        if deadline:
+            deadline.check('chroma')
         
-        # Group consecutive identical chords
-        grouped = []
-        current_chord = None
-        current_start = 0
-        min_chord_duration = 2.0  # Minimum 2 seconds per chord
+        # Long tracks are split into windows and scored on all cores
+        if ANALYSIS_WORKERS > 1 and len(y) / sr >= PARALLEL_MIN_SECONDS:
+            from parallel_analysis import analyze_signal_parallel
+            print(f"🎸 Processing chroma in parallel on {ANALYSIS_WORKERS} workers...")
+            scored = analyze_signal_parallel(y, sr, ANALYSIS_WORKERS, deadline=deadline)
+        else:
+            # Extract chroma features for chord detection
+            chroma = compute_chroma(y, sr)
+            print(f"🎸 Processing {chroma.shape[1]} chroma frames...")
+            scored = score_frames(chroma, np.arange(0, chroma.shape[1], FRAME_STEP))
         
-        for c in chords:
-            if c['chord'] != current_chord:
-                if current_chord:
-                    grouped.append({
-                        'chord': current_chord,
-                        'time': current_start,
-                        'confidence': c['confidence']
-                    })
-                current_chord = c['chord']
-                current_start = c['time']
+        if deadline:
+            deadline.check('matching')
         
-        # Add final chord
-        if current_chord:
-            grouped.append({
-                'chord': current_chord,
-                'time': current_start,
-                'confidence': 0.7
-            })
-        
-        # Filter by minimum duration
-        filtered = []
-        for i, c in enumerate(grouped):
-            next_time = grouped[i + 1]['time'] if i + 1 < len(grouped) else max_duration
-            duration_calc = next_time - c['time']
-            
-            if duration_calc >= min_chord_duration:
-                filtered.append(c)
+        # Detect chords using template matching, then group consecutive identical chords
+        chords = frames_to_chords(scored, sr)
+        filtered = group_chords(chords, max_duration)
         
         print(f"🎸 Real chord analysis complete: {len(filtered)} chords detected")
         
@@ -263,22 +274,504 @@ def extract_chords_from_audio(audio_path, duration):
         for i, chord in enumerate(filtered[:5]):
             print(f"  {i+1}. {chord['chord']} at {chord['time']:.1f}s (confidence: {chord['confidence']:.2f})")
         
-        return filtered if filtered else [
-            {'chord': 'C', 'time': 0, 'confidence': 0.7},
-            {'chord': 'G', 'time': 4, 'confidence': 0.7},
-            {'chord': 'Am', 'time': 8, 'confidence': 0.7},
-            {'chord': 'F', 'time': 12, 'confidence': 0.7}
-        ]
+        # A canned progression would be stored as if it were real; let the caller decide
+        if not filtered:
+            raise Exception("No chords detected in the audio")
+        return filtered
         
+    except (AnalysisCancelled, ImportError):
+        raise
     except Exception as e:
         print(f"❌ Chord analysis error: {e}")
-        # Return basic progression as fallback
-        return [
-            {'chord': 'C', 'time': 0, 'confidence': 0.7},
-            {'chord': 'G', 'time': 4, 'confidence': 0.7},
-            {'chord': 'Am', 'time': 8, 'confidence': 0.7},
-            {'chord': 'F', 'time': 12, 'confidence': 0.7}
-        ]
+        raise Exception(f"Chord analysis failed: {str(e)}")
+
+def extract_preview_chords(audio_path, duration, deadline=None):
+    """
+    Fast provisional chords for the opening PREVIEW_SECONDS: downsampled audio,
+    STFT chroma on a coarse hop, and only the chords of the estimated key.
+    Returns (chords, seconds covered).
+    """
+    import librosa
+    import numpy as np
+    from chord_analysis import (
+        PREVIEW_SAMPLE_RATE, PREVIEW_HOP_LENGTH, PREVIEW_FRAME_STEP, PREVIEW_CONFIDENCE_THRESHOLD,
+        compute_preview_chroma, estimate_key, key_name, key_vocabulary,
+        score_frames, frames_to_chords, group_chords
+    )
+
+    if deadline:
+        deadline.check('decode')
+    covered = min(duration, PREVIEW_SECONDS)
+    y, sr = librosa.load(audio_path, sr=PREVIEW_SAMPLE_RATE, mono=True, duration=covered, res_type='soxr_lq')
+
+    if deadline:
+        deadline.check('chroma')
+    chroma = compute_preview_chroma(y, sr)
+    tonic, is_minor = estimate_key(chroma)
+    vocabulary = key_vocabulary(tonic, is_minor)
+    print(f"⚡ Preview of {len(y)/sr:.1f}s in {key_name(tonic, is_minor)} with {len(vocabulary)} chords")
+
+    if deadline:
+        deadline.check('matching')
+    scored = score_frames(chroma, np.arange(0, chroma.shape[1], PREVIEW_FRAME_STEP), vocabulary)
+    chords = group_chords(
+        frames_to_chords(scored, sr, PREVIEW_HOP_LENGTH, PREVIEW_CONFIDENCE_THRESHOLD), covered
+    )
+    return chords, covered
+
+class YtDlpAudioSource(AudioSource):
+    """Real YouTube audio through yt-dlp"""
+
+    name = 'youtube'
+
+    def fetch(self, url, deadline=None, temp_dir=None, on_metadata=None, max_seconds=None):
+        return download_youtube_audio(
+            url, deadline=deadline, temp_dir=temp_dir, on_metadata=on_metadata, max_seconds=max_seconds
+        )
+
+def create_audio_source(name):
+    """AUDIO_SOURCE=fake serves fixture files for offline load tests"""
+    if name == 'fake':
+        return FakeAudioSource()
+    return YtDlpAudioSource()
+
+audio_source = create_audio_source(os.environ.get('AUDIO_SOURCE', 'youtube'))
+
+def process_memory_mb():
+    """Current and peak resident memory of this worker process"""
+    current = peak = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"rss_mb": current, "peak_rss_mb": peak}
+
+def probe_audio_duration(audio_path):
+    """Duration of a local audio file; raises UploadError if it cannot be decoded"""
+    try:
+        import soundfile as sf
+        return sf.info(audio_path).duration
+    except ImportError:
+        raise
+    except Exception:
+        pass
+    try:
+        import librosa
+        return librosa.get_duration(path=audio_path)
+    except ImportError:
+        raise
+    except Exception as e:
+        error = UploadError(f"Could not decode the uploaded audio: {str(e) or type(e).__name__}")
+        error.status_code = 415
+        raise error
+
+def build_chord_timeline(raw_chords, duration):
+    """Convert detected chords to the frontend format"""
+    chords = []
+    for i, chord in enumerate(raw_chords):
+        # Calculate duration until next chord
+        if i < len(raw_chords) - 1:
+            duration_calc = raw_chords[i + 1]['time'] - chord['time']
+        else:
+            duration_calc = duration - chord['time']
+        
+        duration_calc = max(2.0, duration_calc)  # Minimum 2 seconds
+        
+        chords.append({
+            'chord': chord['chord'],
+            'time': chord['time'],  # Use 'time' for PlayerScreen compatibility
+            'duration': duration_calc,
+            'confidence': chord['confidence'],
+            'beat': (i % 4) + 1
+        })
+    return chords
+
+def shift_chord_timeline(chords, offset, duration):
+    """Move a stored timeline by offset seconds onto another upload of the same song"""
+    shifted = []
+    for i, chord in enumerate(chords):
+        end = chords[i + 1]['time'] if i + 1 < len(chords) else chord['time'] + chord['duration']
+        if end + offset <= 0:
+            continue
+        shifted.append({
+            'chord': chord['chord'],
+            'time': max(0.0, chord['time'] + offset),
+            'confidence': chord['confidence']
+        })
+    return build_chord_timeline(shifted, duration)
+
+def indexable(record):
+    return record.get('analyzer_version') == ANALYZER_VERSION and record.get('tier') != 'preview'
+
+def index_analysis(record):
+    """Add a stored analysis to the in-memory search indexes"""
+    if not indexable(record):
+        return
+    fingerprint = fingerprint_store.get(record['store_key'])
+    if fingerprint:
+        fingerprint_index.add(record['store_key'], fingerprint)
+    # A curated timeline for the same video stays the indexed one
+    if not song_catalog.get(record['store_key']):
+        progression_index.add(record['store_key'], record['chords'], title=record.get('title'))
+
+def save_analysis(key, record):
+    """Store a finished analysis and make it searchable right away"""
+    # Clients compare revisions to notice that a result was replaced (e.g. a refined preview)
+    previous = analysis_store.get(key)
+    record = dict(record, revision=(previous or {}).get('revision', 0) + 1)
+    record = analysis_store.put(key, record)
+    index_analysis(record)
+    return record
+
+def load_indexes():
+    """Rebuild the search indexes from every stored analysis"""
+    fingerprints = []
+    for record in analysis_store.iter_records():
+        if not indexable(record):
+            continue
+        fingerprint = fingerprint_store.get(record['store_key'])
+        if fingerprint:
+            fingerprints.append((record['store_key'], fingerprint))
+        if not song_catalog.get(record['store_key']):
+            progression_index.add(record['store_key'], record['chords'], title=record.get('title'))
+    # One sort for the whole fingerprint index instead of a merge every few hundred songs
+    fingerprint_index.load(fingerprints)
+    print(f"🔍 Indexes loaded: {len(fingerprint_index)} fingerprints, {len(progression_index)} progressions")
+
+def get_current_analysis(video_id, allow_preview=False):
+    """
+    Stored analysis for video_id if it was made by the current analyzer.
+    Preview-tier records only count when the caller asked for a preview.
+    """
+    if not video_id:
+        return None
+    record = analysis_store.get(video_id)
+    if not record or record.get('analyzer_version') != ANALYZER_VERSION:
+        return None
+    if record.get('tier') == 'preview' and not allow_preview:
+        return None
+    return record
+
+def cached_extra(record, cache_source):
+    """Response fields for a stored record; previews say that the full pass is still coming"""
+    extra = {"cached": True, "cache_source": cache_source}
+    if record.get('tier') == 'preview':
+        extra["refining"] = True
+    return extra
+
+def get_stale_analysis(video_id):
+    """Stored analysis for video_id made by an older analyzer, if any"""
+    if not video_id:
+        return None
+    record = analysis_store.get(video_id)
+    if record and record.get('analyzer_version') != ANALYZER_VERSION:
+        return record
+    return None
+
+# Response fields for curated answers
+CATALOG_RESPONSE = {
+    "cached": True,
+    "cache_source": "catalog",
+    "method": "Curated chord catalog",
+    "analysis_type": "curated_catalog"
+}
+
+def catalog_record(entry, url, video_id=None, duration=None):
+    """Record-shaped view of a curated catalog entry"""
+    raw_chords = entry_chords(entry)
+    duration = entry.get('duration') or duration or (raw_chords[-1]['time'] + 4 if raw_chords else 0)
+    chords = build_chord_timeline(raw_chords, duration)
+    return {
+        "video_id": video_id or extract_video_id(url),
+        "url": url,
+        "title": f"{entry['artist']} - {entry['title']}" if entry.get('artist') else entry['title'],
+        "duration": duration,
+        "chords": chords,
+        "key": entry.get('key') or (chords[0]['chord'] if chords else "C"),
+        "bpm": entry.get('bpm', 120),
+        "analyzer_version": None
+    }
+
+# Keys of the catalog entries currently in the progression index
+indexed_catalog_keys = set()
+indexed_catalog_lock = threading.Lock()
+
+def index_catalog(entries):
+    """Catalog reload hook: curated songs are searchable under their catalog_key"""
+    keys = {catalog_key(entry): entry for entry in entries}
+    with indexed_catalog_lock:
+        for key in indexed_catalog_keys - keys.keys():
+            progression_index.remove(key)
+            # A stored analysis of a song dropped from the catalog becomes the indexed one again
+            record = analysis_store.get(key)
+            if record and indexable(record):
+                progression_index.add(key, record['chords'], title=record.get('title'))
+        for key, entry in keys.items():
+            record = catalog_record(entry, None, key)
+            progression_index.add(key, record['chords'], title=record['title'])
+        indexed_catalog_keys.clear()
+        indexed_catalog_keys.update(keys)
+
+def catalog_timeline(entry, key):
+    """Windowed timeline of a curated entry for /api/songs/<id>/chords"""
+    record = catalog_record(entry, None, key)
+    return ChordTimeline(record['chords'], record)
+
+# Curated, verified timelines served before any download (hot-reloaded from disk); they
+# are never stored, so the catalog feeds the progression index and timeline lookups itself
+song_catalog = SongCatalog(on_change=index_catalog)
+
+def analysis_response(record, url, **extra):
+    """Build the analyze-song JSON body from a stored record"""
+    body = {
+        "status": "success",
+        "url": url,
+        "chords": record['chords'],
+        "duration": record['duration'],
+        "title": record['title'],
+        "key": record['key'],
+        "bpm": record['bpm'],
+        "analysis_time": time.time(),
+        "method": "REAL Audio Analysis with librosa",
+        "analysis_type": "real_audio_analysis",
+        "video_id": record.get('video_id'),
+        "analyzer_version": record.get('analyzer_version'),
+        "tier": record.get('tier', 'full'),
+        "revision": record.get('revision')
+    }
+    body.update(extra)
+    return jsonify(body)
+
+def overloaded_response(e):
+    """503 with Retry-After for a request shed at admission"""
+    print(f"🚦 Rejected at admission: {e}")
+    response = jsonify({
+        "status": "error",
+        "error": str(e),
+        "reason": "overloaded",
+        "estimated_wait": round(e.estimated_wait, 1)
+    })
+    response.headers['Retry-After'] = str(max(1, int(e.estimated_wait - e.remaining) + 1))
+    return response, 503
+
+def cancelled_response(e):
+    """504 for an analysis stopped by its deadline or a disconnected client"""
+    print(f"🛑 {e}")
+    return jsonify({
+        "status": "error",
+        "error": str(e),
+        "reason": e.reason,
+        "stage": e.stage
+    }), 504
+
+def analyze_audio_file(audio_path, duration, key, deadline=None, **fields):
+    """
+    Fingerprint-match or fully analyze a local audio file and store the result
+    under key (unless key is None). Returns (record, extra response fields).
+    """
+    # Recognize re-uploads of a song we already analyzed
+    if deadline:
+        deadline.check('fingerprint')
+    fingerprint = {}
+    try:
+        fingerprint = compute_fingerprint(audio_path)
+        match = fingerprint_index.match(fingerprint, exclude=key) if FINGERPRINT_MATCHING else None
+    except Exception as fp_error:
+        print(f"⚠️ Fingerprinting failed: {fp_error}")
+        match = None
+
+    matched = analysis_store.get(match[0]) if match else None
+    # The vote only nominates a candidate; its chroma must line up at the voted offset too
+    if matched and not verify_alignment(fingerprint, fingerprint_store.get(match[0]), match[1]):
+        print(f"🔍 Fingerprint candidate {match[0]} rejected: chroma does not line up")
+        matched = None
+    if matched and matched.get('analyzer_version') == ANALYZER_VERSION:
+        matched_key, offset, votes = match
+        print(f"🔍 Fingerprint match: {matched_key} (offset {offset:+.2f}s, {votes} votes)")
+        chords = shift_chord_timeline(matched['chords'], offset, duration)
+        bpm = matched['bpm']
+        source = {
+            "source": "fingerprint_match",
+            "matched_video_id": matched.get('video_id'),
+            "offset": offset
+        }
+    else:
+        raw_chords = extract_chords_from_audio(audio_path, duration, deadline=deadline)
+        print(f"✅ Analyzed {len(raw_chords)} chords from real audio")
+        chords = build_chord_timeline(raw_chords, duration)
+        bpm = random.randint(80, 140)
+        source = {"source": "analysis"}
+
+    record = {
+        "duration": duration,
+        "chords": chords,
+        "key": chords[0]['chord'] if chords else "C",
+        "bpm": bpm,
+        "analyzer_version": ANALYZER_VERSION,
+        "tier": "full",
+        **fields,
+        **source
+    }
+    if key:
+        # Written first: saving the record indexes whatever fingerprint is stored for key
+        if fingerprint:
+            fingerprint_store.put(key, fingerprint)
+        else:
+            fingerprint_store.remove(key)
+        record = save_analysis(key, record)
+
+    if source['source'] == "fingerprint_match":
+        return record, {
+            "cached": True,
+            "cache_source": "fingerprint",
+            "matched_video_id": source['matched_video_id']
+        }
+    return record, {}
+
+def preview_audio_file(audio_path, duration, key, deadline=None, **fields):
+    """Store and return a provisional preview-tier record for the opening seconds"""
+    raw_chords, covered = extract_preview_chords(audio_path, duration, deadline=deadline)
+    chords = build_chord_timeline(raw_chords, covered)
+    record = {
+        "duration": duration,
+        "chords": chords,
+        # Same definition as the full tier, so the field keeps its meaning when the refined record arrives
+        "key": chords[0]['chord'] if chords else "C",
+        "bpm": random.randint(80, 140),
+        "analyzer_version": ANALYZER_VERSION,
+        "tier": "preview",
+        "preview_seconds": covered,
+        "source": "preview",
+        **fields
+    }
+    return save_analysis(key, record) if key else record
+
+# Full-resolution passes that replace previews, one per analysis slot
+refine_executor = ThreadPoolExecutor(max_workers=admission.slots, thread_name_prefix='refine')
+# In-flight refinements by video id, so full-tier requests can wait instead of analyzing twice
+refine_jobs = {}
+refine_jobs_lock = threading.Lock()
+
+def start_refinement(url, key):
+    future = refine_executor.submit(refine_url, url, key)
+    with refine_jobs_lock:
+        refine_jobs[key] = future
+
+    def forget(done):
+        with refine_jobs_lock:
+            if refine_jobs.get(key) is done:
+                del refine_jobs[key]
+    future.add_done_callback(forget)
+
+def wait_for_refinement(video_id, deadline=None):
+    """
+    Block until an in-flight refinement of video_id finishes and return its
+    full-tier record; None when nothing is refining it or the refinement failed.
+    Call this without holding an analysis slot: the refinement needs one.
+    """
+    with refine_jobs_lock:
+        future = refine_jobs.get(video_id)
+    if future is None:
+        return None
+    print(f"⏳ Waiting for the running refinement of {video_id}")
+    while True:
+        if deadline:
+            deadline.check('refinement')
+        try:
+            future.result(timeout=0.5)
+            break
+        except FutureTimeout:
+            continue
+    return get_current_analysis(video_id)
+
+def refine_url(url, key):
+    """Background job: download the whole track and store the full analysis over the preview"""
+    try:
+        deadline = AnalysisDeadline(REFINE_DEADLINE_SECONDS)
+        with admission.slot(deadline) as held:
+            record, extra = analyze_url(url, deadline)
+            if not extra.get('cached'):
+                held.mark_analyzed()
+        print(f"✨ Refined preview of {key} (revision {record.get('revision')})")
+    except Exception as e:
+        # The preview stays; the re-analysis scheduler picks up orphaned previews later
+        print(f"⚠️ Refining preview of {key} failed: {e}")
+
+def analyze_url(url, deadline=None, preview=False, use_catalog=True):
+    """
+    Download and analyze one YouTube URL, reusing stored results where possible.
+    With preview=True only the opening PREVIEW_SECONDS are downloaded, a
+    provisional preview-tier record is returned right away, and a background job
+    downloads the whole track and replaces it with the full analysis.
+    Returns (record, extra response fields).
+    """
+    def check_catalog(video_id, title, duration):
+        # The real video title is only known after extraction; still early enough to skip the download
+        entry = song_catalog.lookup(video_id, title, duration=duration) if use_catalog else None
+        if entry:
+            print(f"📚 Video title matches curated timeline for {entry['title']}")
+            raise SkipDownload(catalog_record(entry, url, video_id, duration))
+
+    # Previews are stored and refined by video ID; without one there is nothing to refine
+    preview = preview and extract_video_id(url) is not None
+
+    # Main processing with temporary directory
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"📁 Processing in temp directory: {tmpdir}")
+        
+        # Step 1: Download audio (only the opening seconds for a preview)
+        try:
+            audio_path, duration, title, video_id = audio_source.fetch(
+                url, deadline=deadline, temp_dir=tmpdir, on_metadata=check_catalog,
+                max_seconds=PREVIEW_SECONDS if preview else None
+            )
+        except SkipDownload as curated:
+            return curated.result, dict(CATALOG_RESPONSE)
+        print(f"✅ Audio downloaded: {audio_path}")
+        
+        if not os.path.exists(audio_path):
+            raise Exception("Audio file not found after download")
+
+        cached = get_current_analysis(video_id, allow_preview=preview)
+        if cached:
+            return cached, cached_extra(cached, "video_id")
+
+        fields = {"video_id": video_id, "url": url, "title": title}
+
+        # Step 2a: Preview now, full resolution later
+        if preview:
+            key = video_id or extract_video_id(url)
+            record = preview_audio_file(audio_path, duration, key, deadline, **fields)
+            start_refinement(url, key)
+            return record, {"refining": True}
+
+        # Step 2b: Match against stored songs, or analyze chords
+        return analyze_audio_file(audio_path, duration, video_id, deadline, **fields)
+
+def reanalyze_record(record, deadline):
+    """Background job: run the full pipeline again for a stale stored song"""
+    # A real slot, so the host never runs more analyses than it has slots; foreground
+    # demand preempts it through the deadline's foreground_busy probe
+    with admission.background_slot():
+        # Curated answers are never stored, so they would leave the record stale forever
+        analyze_url(record['url'], deadline, use_catalog=False)
+    # Failed analyses raise before anything is stored; also make sure the new result
+    # landed under this record's key rather than somewhere else
+    refreshed = analysis_store.get(record['store_key'])
+    if not refreshed or refreshed.get('analyzer_version') != ANALYZER_VERSION or refreshed.get('tier') == 'preview':
+        raise Exception(f"Re-analysis did not store a current result for {record['store_key']}")
+
+# Refreshes stale results after ANALYZER_VERSION changes, most requested songs first
+reanalysis_scheduler = ReanalysisScheduler(
+    analysis_store, popularity, reanalyze_record, admission.foreground_busy,
+    ANALYZER_VERSION, os.path.join(DATA_DIR, 'reanalysis.lock')
+)
 
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
@@ -290,6 +783,7 @@ def health_check():
         "web_build_exists": os.path.exists(WEB_BUILD_PATH),
         "real_analysis": "enabled",
         "ffmpeg_available": check_ffmpeg(),
+        "analysis_load": admission.stats(),
         "dependencies": {
             "yt_dlp": True,
             "librosa": True,
@@ -297,6 +791,17 @@ def health_check():
         }
     })
 
+# Cheap per-worker stats for load tests (no subprocess calls, unlike /api/health)
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "pid": os.getpid(),
+        "audio_source": audio_source.name,
+        "memory": process_memory_mb(),
+        "analysis_load": admission.stats(),
+        "reanalysis": reanalysis_scheduler.stats()
+    })
+
 # Test chords endpoint
 @app.route('/api/test-chords', methods=['GET'])
 def test_chords():
@@ -308,6 +813,127 @@ def test_chords():
         "analysis_type": "test_endpoint"
     })
 
+# Chord timeline window for client-side sync
+@app.route('/api/songs/<video_id>/chords', methods=['GET'])
+def song_chords(video_id):
+    curated = song_catalog.get(video_id)
+    timeline = catalog_timeline(curated, video_id) if curated else timeline_cache.get(video_id)
+    if timeline is None:
+        return jsonify({
+            "status": "error",
+            "error": f"Song not analyzed yet: {video_id}"
+        }), 404
+
+    try:
+        start = float(request.args.get('from', 0))
+        end = float(request.args['to']) if 'to' in request.args else float('inf')
+        at = float(request.args['at']) if 'at' in request.args else None
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "error": "from, to and at must be numbers of seconds"
+        }), 400
+
+    if end < start:
+        return jsonify({
+            "status": "error",
+            "error": "to must not be before from"
+        }), 400
+
+    body = {
+        "status": "success",
+        "video_id": video_id,
+        "title": timeline.title,
+        "duration": timeline.duration,
+        "total_chords": len(timeline),
+        "analyzer_version": timeline.analyzer_version,
+        "tier": timeline.tier,
+        "revision": timeline.revision
+    }
+    # A bare ?at= lookup skips the window so polling clients get a tiny response
+    if at is None or 'from' in request.args or 'to' in request.args:
+        body["from"] = start
+        body["to"] = None if end == float('inf') else end
+        body["chords"] = timeline.window(start, end)
+    if at is not None:
+        body["at"] = at
+        body["current"] = timeline.chord_at(at)
+    return jsonify(body)
+
+# Stored request profiles (folded stacks, render with any flame graph tool); token in X-Profile-Token only
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    if not profiling_token_valid(request.headers.get('X-Profile-Token', '')):
+        return jsonify({
+            "status": "error",
+            "error": "A valid profiling token is required"
+        }), 403
+    profiles = profile_store.list()
+    return jsonify({
+        "status": "success",
+        "profiles": profiles,
+        "count": len(profiles)
+    })
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    if not profiling_token_valid(request.headers.get('X-Profile-Token', '')):
+        return jsonify({
+            "status": "error",
+            "error": "A valid profiling token is required"
+        }), 403
+    path = profile_store.folded_path(profile_id)
+    if path is None:
+        return jsonify({
+            "status": "error",
+            "error": f"Profile not found: {profile_id}"
+        }), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True,
+                     download_name=f"{profile_id}.folded")
+
+# Similar songs by shared chord progressions
+@app.route('/api/similar', methods=['GET'])
+def similar_songs():
+    song = request.args.get('song', '').strip()
+    progression = request.args.get('progression', '').strip()
+    try:
+        limit = max(1, min(100, int(request.args.get('limit', 20))))
+    except ValueError:
+        limit = 20
+
+    if not song and not progression:
+        return jsonify({
+            "status": "error",
+            "error": "Either song or progression is required"
+        }), 400
+
+    started = time.perf_counter()
+    try:
+        if song:
+            key = extract_video_id(song) or song
+            curated = song_catalog.get(key)
+            results = progression_index.query_song(catalog_key(curated) if curated else key, limit)
+            if results is None:
+                return jsonify({
+                    "status": "error",
+                    "error": f"Song not analyzed yet: {song}"
+                }), 404
+        else:
+            results = progression_index.query_progression(progression, limit)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 400
+
+    return jsonify({
+        "status": "success",
+        "query": {"song": song} if song else {"progression": progression},
+        "results": results,
+        "indexed_songs": len(progression_index),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
 # MAIN REAL CHORD ANALYSIS ENDPOINT
 @app.route('/api/analyze-song', methods=['POST', 'OPTIONS'])
 def analyze_song():
@@ -330,66 +956,73 @@ def analyze_song():
             }), 400
 
         print(f'🎵 Starting REAL chord analysis for: {url}')
+        popularity.hit(extract_video_id(url))
+
+        # Curated songs come back instantly, before any download
+        curated = song_catalog.lookup(extract_video_id(url), data.get('title'), data.get('artist'))
+        if curated:
+            print(f"📚 Returning curated timeline for {curated['title']}")
+            return analysis_response(catalog_record(curated, url), url, **CATALOG_RESPONSE)
+
+        # Opt-in: answer with a preview-tier timeline and refine it in the background
+        wants_preview = str(data.get('preview', request.args.get('preview', ''))).lower() in ('1', 'true')
+
+        # Same video analyzed before: skip the download entirely
+        cached = get_current_analysis(extract_video_id(url), allow_preview=wants_preview)
+        if cached:
+            print(f"⚡ Returning stored {cached.get('tier', 'full')} analysis for {cached['video_id']}")
+            return analysis_response(cached, url, **cached_extra(cached, "video_id"))
+
+        # Made by an older analyzer: answer now and move it to the front of the re-analysis
+        # queue, unless no worker runs the scheduler (then analyze it right here)
+        stale = get_stale_analysis(extract_video_id(url)) if REANALYSIS_ENABLED else None
+        if stale and reanalysis_scheduler.prioritize(stale['store_key']):
+            print(f"♻️ Returning stale analysis for {stale['video_id']} while it is refreshed")
+            return analysis_response(stale, url, cached=True, cache_source="stale", stale=True)
 
         # REAL CHORD ANALYSIS IMPLEMENTATION
         try:
-            # Import required libraries for real analysis
-            import yt_dlp
+            # Import required libraries for real analysis (the fake source needs no yt-dlp)
+            if audio_source.name == 'youtube':
+                import yt_dlp
             import librosa
             import numpy as np
 
-            # Main processing with temporary directory
-            with tempfile.TemporaryDirectory() as tmpdir:
-                original_dir = os.getcwd()
-                try:
-                    os.chdir(tmpdir)
-                    print(f"📁 Processing in temp directory: {tmpdir}")
-                    
-                    # Step 1: Download audio
-                    audio_path, duration, title = download_youtube_audio(url)
-                    print(f"✅ Audio downloaded: {audio_path}")
-                    
-                    # Step 2: Analyze chords
-                    if os.path.exists(audio_path):
-                        raw_chords = extract_chords_from_audio(audio_path, duration)
-                        print(f"✅ Analyzed {len(raw_chords)} chords from real audio")
-                        
-                        # Convert to frontend format
-                        chords = []
-                        for i, chord in enumerate(raw_chords):
-                            # Calculate duration until next chord
-                            if i < len(raw_chords) - 1:
-                                duration_calc = raw_chords[i + 1]['time'] - chord['time']
-                            else:
-                                duration_calc = duration - chord['time']
-                            
-                            duration_calc = max(2.0, duration_calc)  # Minimum 2 seconds
-                            
-                            chords.append({
-                                'chord': chord['chord'],
-                                'time': chord['time'],  # Use 'time' for PlayerScreen compatibility
-                                'duration': duration_calc,
-                                'confidence': chord['confidence'],
-                                'beat': (i % 4) + 1
-                            })
-                        
-                        return jsonify({
-                            "status": "success",
-                            "url": url,
-                            "chords": chords,
-                            "duration": duration,
-                            "title": title,
-                            "key": chords[0]['chord'] if chords else "C",
-                            "bpm": random.randint(80, 140),
-                            "analysis_time": time.time(),
-                            "method": "REAL Audio Analysis with librosa",
-                            "analysis_type": "real_audio_analysis"
-                        })
-                    else:
-                        raise Exception("Audio file not found after download")
-                        
-                finally:
-                    os.chdir(original_dir)
+            # A preview promises a quick answer, so it gets its own shorter budget
+            deadline_seconds = request_deadline_seconds(data, request.headers)
+            if wants_preview:
+                deadline_seconds = min(deadline_seconds, PREVIEW_DEADLINE_SECONDS)
+            deadline = AnalysisDeadline(deadline_seconds, client_disconnect_probe(request.environ))
+            # Only a preview is stored so far: the full pass is already running, wait for it
+            if not wants_preview:
+                refined = wait_for_refinement(extract_video_id(url), deadline)
+                if refined:
+                    return analysis_response(refined, url, cached=True, cache_source="refinement")
+
+            profiled = should_profile(
+                str(data.get('profile', request.args.get('profile', ''))).lower() in ('1', 'true'),
+                request.headers.get('X-Profile-Token', '')
+            )
+            with admission.slot(deadline) as held:
+                profile_meta = {"endpoint": "/api/analyze-song", "url": url, "deadline_seconds": deadline.seconds}
+                with profile_request(profiled, profile_store, profile_meta) as profile_extra:
+                    record, extra = analyze_url(url, deadline, preview=wants_preview)
+                    # Catalog and stored answers found after extraction do not count as analyses
+                    if not extra.get('cached'):
+                        held.mark_analyzed()
+                    profile_extra.update(
+                        video_id=record.get('video_id'),
+                        source=record.get('source'),
+                        cache_source=extra.get('cache_source'),
+                        duration=record.get('duration')
+                    )
+            return analysis_response(record, url, **extra)
+
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        except AnalysisCancelled as e:
+            return cancelled_response(e)
 
         except ImportError as e:
             print(f"❌ Missing dependencies for real analysis: {e}")
@@ -440,6 +1073,81 @@ def analyze_song():
             "error": f"Analysis request failed: {str(e)}"
         }), 500
 
+# Chord analysis of a user's own recording, streamed to disk with bounded memory
+@app.route('/api/analyze-upload', methods=['POST', 'OPTIONS'])
+def analyze_upload():
+    # Handle OPTIONS for CORS
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    print('🎵 === UPLOAD CHORD ANALYSIS STARTED ===')
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Never touch request.files/request.form: they would parse the whole body up front
+            audio_path, sha256, size, filename, fields = receive_upload(
+                request.stream, request.content_type, request.content_length,
+                request.headers, tmpdir,
+                deadline=AnalysisDeadline(UPLOAD_TRANSFER_SECONDS, client_disconnect_probe(request.environ))
+            )
+            # The analysis deadline only starts once the body is here
+            deadline = AnalysisDeadline(
+                request_deadline_seconds(request.args, request.headers),
+                client_disconnect_probe(request.environ)
+            )
+            upload_id = f"upload-{sha256}"
+            print(f"📥 Received {size / (1024 * 1024):.1f} MB upload {filename or '(unnamed)'} as {upload_id}")
+
+            # Same bytes uploaded before: reuse the stored result
+            cached = get_current_analysis(upload_id)
+            if cached:
+                print(f"⚡ Returning stored analysis for {upload_id}")
+                return analysis_response(cached, None, cached=True, cache_source="content_hash", upload_id=upload_id)
+
+            duration = probe_audio_duration(audio_path)
+            title = fields.get('title') or os.path.splitext(filename)[0] or "Uploaded recording"
+            if fields.get('artist'):
+                title = f"{fields['artist']} - {title}"
+
+            # Receiving the body holds no slot; only the analysis does
+            with admission.slot(deadline) as held:
+                record, extra = analyze_audio_file(
+                    audio_path, duration, upload_id, deadline,
+                    video_id=None, url=None, title=title, upload_bytes=size
+                )
+                if not extra.get('cached'):
+                    held.mark_analyzed()
+            return analysis_response(
+                record, None, upload_id=upload_id,
+                method="REAL Audio Analysis with librosa (upload)", **extra
+            )
+
+    except UploadError as e:
+        print(f"❌ Rejected upload: {e}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), e.status_code
+
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    except AnalysisCancelled as e:
+        return cancelled_response(e)
+
+    except ImportError as e:
+        print(f"❌ Missing dependencies for upload analysis: {e}")
+        return jsonify({
+            "status": "error",
+            "error": f"Audio analysis is not available on this server: {str(e)}"
+        }), 503
+
+    except Exception as e:
+        print(f"❌ Upload analysis failed: {e}")
+        return jsonify({
+            "status": "error",
+            "error": f"Upload analysis failed: {str(e)}"
+        }), 500
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     
@@ -457,6 +1165,10 @@ if __name__ == '__main__':
     
     local_ip = get_local_ip()
     
+    load_indexes()
+    if REANALYSIS_ENABLED:
+        reanalysis_scheduler.start()
+    
     print("🎵 === ChordsLegend REAL Chord Detection Server ===")
     print(f"🌐 Server: http://0.0.0.0:{port}")
     print(f"🌐 Local: http://{local_ip}:{port}")
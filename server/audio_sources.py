@@ -0,0 +1,157 @@
+"""
+Pluggable sources of song audio for the analysis pipeline
+
+The API server normally fetches audio with yt-dlp. For offline load tests,
+AUDIO_SOURCE=fake swaps in FakeAudioSource, which serves fixture files from
+disk and imitates the extractor's latency, format choice and failures.
+"""
+
+import os
+import re
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+
+FAKE_AUDIO_DIR = os.environ.get(
+    'FAKE_AUDIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'audio')
+)
+FAKE_EXTRACT_SECONDS = float(os.environ.get('FAKE_EXTRACT_SECONDS', 1.5))
+FAKE_BANDWIDTH_BYTES = float(os.environ.get('FAKE_BANDWIDTH_BYTES', 2_000_000))
+FAKE_FAILURE_RATE = float(os.environ.get('FAKE_FAILURE_RATE', 0))
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+# Same preference order as the yt-dlp format string in download_youtube_audio
+FORMAT_PREFERENCE = ['.m4a', '.webm', '.opus', '.ogg', '.mp3', '.wav', '.flac', '.mp4']
+
+
+def extract_video_id(url):
+    """Pull the 11-character video ID out of a YouTube URL without a network call"""
+    match = YOUTUBE_ID_PATTERN.search(url or '')
+    return match.group(1) if match else None
+
+
+class SkipDownload(Exception):
+    """Raised by an on_metadata callback when the audio is not needed after all"""
+
+    def __init__(self, result):
+        super().__init__("Download skipped")
+        self.result = result
+
+
+class AudioSource:
+    """Fetches the audio for a URL into temp_dir"""
+
+    name = 'base'
+
+    def fetch(self, url, deadline=None, temp_dir=None, on_metadata=None, max_seconds=None):
+        """
+        Return (audio_path, duration, title, video_id). on_metadata(video_id,
+        title, duration) is called once the metadata is known and before any
+        audio is downloaded; it may raise SkipDownload. With max_seconds only
+        the opening seconds are fetched; duration is still the whole track's.
+        """
+        raise NotImplementedError
+
+
+class FakeAudioSource(AudioSource):
+    """
+    Serves fixture audio instead of YouTube.
+
+    A fixture named <video_id>.<ext> is used for that video ID; any other ID
+    maps onto one of the fixtures by hash. Unique IDs get past the video-ID
+    cache, but the fingerprint index still recognizes the fixture audio after
+    its first analysis; run the server with FINGERPRINT_MATCHING=0 to measure
+    full analyses. When several formats of one fixture exist, the one yt-dlp
+    would prefer is served.
+    """
+
+    name = 'fake'
+
+    def __init__(self, fixture_dir=FAKE_AUDIO_DIR, extract_seconds=FAKE_EXTRACT_SECONDS,
+                 bandwidth_bytes=FAKE_BANDWIDTH_BYTES, failure_rate=FAKE_FAILURE_RATE):
+        self.fixture_dir = fixture_dir
+        self.extract_seconds = extract_seconds
+        self.bandwidth_bytes = bandwidth_bytes
+        self.failure_rate = failure_rate
+        self.fixtures = self._scan()
+        if not self.fixtures:
+            raise Exception(f"No fixture audio found in {fixture_dir}")
+
+    def _scan(self):
+        """Fixture stem -> preferred file path"""
+        fixtures = {}
+        if not os.path.isdir(self.fixture_dir):
+            return fixtures
+        for name in sorted(os.listdir(self.fixture_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in FORMAT_PREFERENCE:
+                continue
+            current = fixtures.get(stem)
+            if current is None or (FORMAT_PREFERENCE.index(ext.lower())
+                                   < FORMAT_PREFERENCE.index(os.path.splitext(current)[1].lower())):
+                fixtures[stem] = os.path.join(self.fixture_dir, name)
+        return fixtures
+
+    def _pick(self, video_id):
+        if video_id in self.fixtures:
+            return self.fixtures[video_id]
+        stems = sorted(self.fixtures)
+        digest = hashlib.sha1((video_id or '').encode('utf-8')).digest()
+        return self.fixtures[stems[int.from_bytes(digest[:4], 'big') % len(stems)]]
+
+    def _sleep(self, seconds, deadline, stage):
+        """Sleep in small steps so deadlines cancel a fake download like a real one"""
+        end = time.monotonic() + seconds
+        while True:
+            if deadline:
+                deadline.check(stage)
+            left = end - time.monotonic()
+            if left <= 0:
+                return
+            time.sleep(min(0.1, left))
+
+    def fetch(self, url, deadline=None, temp_dir=None, on_metadata=None, max_seconds=None):
+        import soundfile as sf
+
+        video_id = extract_video_id(url) or hashlib.sha1(url.encode('utf-8')).hexdigest()[:11]
+
+        # Extractor round trip, jittered like real network calls
+        self._sleep(random.uniform(0.5, 1.5) * self.extract_seconds, deadline, 'extract')
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise Exception(f"Failed to download audio: simulated extractor failure for {video_id}")
+
+        source_path = self._pick(video_id)
+        try:
+            duration = sf.info(source_path).duration
+        except Exception:
+            import librosa
+            duration = librosa.get_duration(path=source_path)
+
+        title = os.path.splitext(os.path.basename(source_path))[0]
+        if on_metadata:
+            on_metadata(video_id, title, duration)
+
+        size = os.path.getsize(source_path)
+        partial = max_seconds is not None and max_seconds < duration
+        if partial:
+            size = size * max_seconds / duration
+        if self.bandwidth_bytes > 0:
+            self._sleep(size / self.bandwidth_bytes, deadline, 'download')
+
+        temp_dir = temp_dir or tempfile.mkdtemp()
+        audio_path = os.path.join(temp_dir, 'audio' + os.path.splitext(source_path)[1])
+        try:
+            if not partial:
+                raise ValueError("whole file requested")
+            info = sf.info(source_path)
+            data, sr = sf.read(source_path, frames=int(max_seconds * info.samplerate), always_2d=True)
+            sf.write(audio_path, data, sr, format=info.format, subtype=info.subtype)
+        except Exception:
+            # Formats soundfile cannot write are served whole, like an unsupported range request
+            shutil.copyfile(source_path, audio_path)
+
+        print(f"🧪 Fake source served {os.path.basename(source_path)} for {video_id}")
+        return audio_path, duration, title, video_id
@@ -0,0 +1,174 @@
+"""
+Streaming receiver for user-uploaded audio
+
+Uploads are read from the WSGI input in fixed-size chunks and written
+straight to a scratch file while their SHA-256 is computed, so a worker's
+memory use does not grow with the file size. Both multipart/form-data (the
+audio in a "file" part, optional "title" / "artist" fields) and a raw body
+with an audio Content-Type are accepted. The size limit is enforced while
+streaming, not only from Content-Length.
+"""
+
+import os
+import hashlib
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Receiving the body has its own budget: a 50 MB file over an ordinary uplink takes minutes,
+# far longer than the analysis deadline
+UPLOAD_TRANSFER_SECONDS = float(os.environ.get('UPLOAD_TRANSFER_SECONDS', 900))
+# Plain form fields (title, artist) are small; anything larger is not a form field
+MAX_FIELD_BYTES = 4 * 1024
+
+# Extensions passed through to the decoder; anything else is stored as .bin and sniffed
+AUDIO_EXTENSIONS = {'.m4a', '.webm', '.opus', '.ogg', '.mp3', '.wav', '.flac', '.mp4', '.aac', '.aiff', '.aif'}
+
+
+class UploadError(Exception):
+    """The request body is not a usable audio upload"""
+
+    status_code = 400
+
+
+class UploadTooLarge(UploadError):
+    status_code = 413
+
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+        self.max_bytes = max_bytes
+
+
+class _ScratchFile:
+    """Size-limited file that hashes everything written to it"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.sha256.update(data)
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+def _extension(filename, content_type):
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in AUDIO_EXTENSIONS:
+        return ext
+    subtype = (content_type or '').split('/')[-1].split(';')[0].strip().lower()
+    guessed = {'mpeg': '.mp3', 'x-wav': '.wav', 'wave': '.wav', 'x-flac': '.flac', 'x-m4a': '.m4a'}.get(subtype, f".{subtype}")
+    return guessed if guessed in AUDIO_EXTENSIONS else '.bin'
+
+
+def _chunks(stream, deadline):
+    while True:
+        if deadline:
+            deadline.check('upload')
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _receive_raw(stream, content_type, headers, temp_dir, max_bytes, deadline):
+    filename = headers.get('X-Filename', '')
+    path = os.path.join(temp_dir, 'upload' + _extension(filename, content_type))
+    scratch = _ScratchFile(path, max_bytes)
+    try:
+        for chunk in _chunks(stream, deadline):
+            scratch.write(chunk)
+    finally:
+        scratch.close()
+    return scratch, filename, {}
+
+
+def _receive_multipart(stream, boundary, temp_dir, max_bytes, deadline):
+    from werkzeug.exceptions import RequestEntityTooLarge
+    from werkzeug.sansio.multipart import MultipartDecoder, Data, Field, File, NeedData, Epilogue
+
+    # The decoder's buffer never holds more than about one chunk; the cap guards against
+    # part headers that never end
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=2 * UPLOAD_CHUNK_BYTES)
+    chunks = _chunks(stream, deadline)
+    scratch = None
+    filename = ''
+    fields = {}
+    current = None  # (kind, name) of the part being read
+    field_value = bytearray()
+
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                decoder.receive_data(next(chunks, None))
+            elif isinstance(event, File):
+                # Only the first file part is kept; extra files are drained and dropped
+                if scratch is None:
+                    filename = event.filename or ''
+                    path = os.path.join(temp_dir, 'upload' + _extension(filename, event.headers.get('Content-Type')))
+                    scratch = _ScratchFile(path, max_bytes)
+                    current = ('file', event.name)
+                else:
+                    current = ('ignored', event.name)
+            elif isinstance(event, Field):
+                current = ('field', event.name)
+                field_value = bytearray()
+            elif isinstance(event, Data):
+                kind, name = current or ('ignored', None)
+                if kind == 'file':
+                    scratch.write(event.data)
+                elif kind == 'field':
+                    field_value += event.data
+                    if len(field_value) > MAX_FIELD_BYTES:
+                        raise UploadError(f"Form field {name} is too large")
+                    if not event.more_data:
+                        fields[name] = field_value.decode('utf-8', 'replace')
+            elif isinstance(event, Epilogue):
+                break
+    except RequestEntityTooLarge:
+        raise UploadError("Multipart part headers are too large")
+    except ValueError as e:
+        # Truncated or malformed multipart bodies surface as ValueError from the decoder
+        raise UploadError(f"Malformed multipart upload: {e}")
+    finally:
+        if scratch:
+            scratch.close()
+
+    if scratch is None:
+        raise UploadError("No audio file part in the upload")
+    return scratch, filename, fields
+
+
+def receive_upload(stream, content_type, content_length, headers, temp_dir,
+                   max_bytes=UPLOAD_MAX_BYTES, deadline=None):
+    """
+    Stream an upload into temp_dir.
+    Returns (audio_path, sha256_hex, size, filename, form_fields).
+    """
+    from werkzeug.http import parse_options_header
+
+    # Reject obviously oversized bodies before reading a byte (multipart adds a little framing)
+    if content_length and content_length > max_bytes + 64 * 1024:
+        raise UploadTooLarge(max_bytes)
+
+    mimetype, options = parse_options_header(content_type or '')
+    if mimetype == 'multipart/form-data':
+        if not options.get('boundary'):
+            raise UploadError("Multipart upload without a boundary")
+        scratch, filename, fields = _receive_multipart(stream, options['boundary'], temp_dir, max_bytes, deadline)
+    elif mimetype.startswith('audio/') or mimetype in ('video/mp4', 'video/webm', 'application/octet-stream'):
+        scratch, filename, fields = _receive_raw(stream, mimetype, headers, temp_dir, max_bytes, deadline)
+    else:
+        raise UploadError("Send the audio as multipart/form-data or as a raw audio/* body")
+
+    if scratch.size == 0:
+        raise UploadError("The uploaded file is empty")
+    return scratch.path, scratch.sha256.hexdigest(), scratch.size, filename, fields
@@ -0,0 +1,178 @@
+"""
+Chord template matching shared by the serial and parallel analysis paths
+"""
+
+import numpy as np
+
+SAMPLE_RATE = 22050
+HOP_LENGTH = 2048
+FRAME_STEP = 8  # Process every 8th frame for stability
+CONFIDENCE_THRESHOLD = 0.3
+MIN_CHORD_DURATION = 2.0  # Minimum 2 seconds per chord
+
+# Preview pass: half the sample rate, STFT chroma and frames twice as long
+PREVIEW_SAMPLE_RATE = 11025
+PREVIEW_HOP_LENGTH = 2048
+PREVIEW_FRAME_STEP = 4  # Same ~0.74s spacing as the full pass
+# STFT chroma leaks energy into neighbouring bins, so template scores run lower than with CQT
+PREVIEW_CONFIDENCE_THRESHOLD = 0.2
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# Krumhansl-Kessler key profiles, starting at the tonic
+MAJOR_PROFILE = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+MINOR_PROFILE = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+# Diatonic triads of a major key as (semitones above the tonic, minor?)
+DIATONIC_TRIADS = [(0, False), (2, True), (4, True), (5, False), (7, False), (9, True)]
+MIN_VOCABULARY = 4
+
+# Chord templates
+CHORD_TEMPLATES = {
+    'C': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
+    'C#': [0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0],
+    'D': [0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0],
+    'D#': [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0],
+    'E': [0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1],
+    'F': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
+    'F#': [0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0],
+    'G': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
+    'G#': [1, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0],
+    'A': [0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0],
+    'A#': [0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 0],
+    'B': [0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1],
+    'Am': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
+    'Em': [0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1],
+    'Dm': [0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 0],
+    'Bm': [0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 1],
+    'F#m': [0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0],
+    'Gm': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
+    'Cm': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
+    'Fm': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0]
+}
+
+CHORD_NAMES = list(CHORD_TEMPLATES.keys())
+
+# Each template normalized to sum to 1, one row per chord
+_TEMPLATE_MATRIX = np.array([CHORD_TEMPLATES[name] for name in CHORD_NAMES], dtype=float)
+_TEMPLATE_MATRIX /= _TEMPLATE_MATRIX.sum(axis=1, keepdims=True)
+
+
+def compute_chroma(y, sr, tuning=None):
+    """Chroma features used for chord detection"""
+    import librosa
+
+    return librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=HOP_LENGTH, tuning=tuning)
+
+
+def compute_preview_chroma(y, sr):
+    """Cheap STFT chroma for the preview pass"""
+    import librosa
+
+    return librosa.feature.chroma_stft(y=y, sr=sr, hop_length=PREVIEW_HOP_LENGTH, n_fft=2 * PREVIEW_HOP_LENGTH)
+
+
+def estimate_key(chroma):
+    """Best-correlating key for the average chroma, as (tonic pitch class, is_minor)"""
+    profile = np.mean(chroma, axis=1)
+    best = None
+    for is_minor, reference in ((False, MAJOR_PROFILE), (True, MINOR_PROFILE)):
+        for tonic in range(12):
+            r = np.corrcoef(profile, np.roll(reference, tonic))[0, 1]
+            if best is None or r > best[0]:
+                best = (r, tonic, is_minor)
+    return best[1], best[2]
+
+
+def key_name(tonic, is_minor):
+    return PITCH_CLASSES[tonic] + ('m' if is_minor else '')
+
+
+def key_vocabulary(tonic, is_minor):
+    """
+    Chords of the key that have templates. Keys whose diatonic chords are
+    mostly missing from the templates fall back to the full vocabulary.
+    """
+    major_tonic = (tonic + 3) % 12 if is_minor else tonic
+    names = [
+        PITCH_CLASSES[(major_tonic + step) % 12] + ('m' if minor else '')
+        for step, minor in DIATONIC_TRIADS
+    ]
+    names = [name for name in names if name in CHORD_TEMPLATES]
+    return names if len(names) >= MIN_VOCABULARY else CHORD_NAMES
+
+
+def score_frames(chroma, frame_indices, chord_names=None):
+    """
+    Match chroma columns against the chord templates (all of them, or only
+    chord_names).
+
+    Returns (frame_index, chord, score) for every requested column; the
+    first template wins ties, as in the original per-template loop.
+    """
+    frame_indices = np.asarray(frame_indices, dtype=int)
+    if frame_indices.size == 0:
+        return []
+
+    if chord_names is None:
+        names, templates = CHORD_NAMES, _TEMPLATE_MATRIX
+    else:
+        names = list(chord_names)
+        templates = _TEMPLATE_MATRIX[[CHORD_NAMES.index(name) for name in names]]
+
+    frames = chroma[:, frame_indices]
+    frames = frames / (np.sum(frames, axis=0, keepdims=True) + 1e-8)
+    scores = templates @ frames
+    best = np.argmax(scores, axis=0)
+    best_scores = scores[best, np.arange(len(frame_indices))]
+
+    return [
+        (int(idx), names[b], float(s))
+        for idx, b, s in zip(frame_indices, best, best_scores)
+    ]
+
+
+def frames_to_chords(scored_frames, sr, hop_length=HOP_LENGTH, threshold=CONFIDENCE_THRESHOLD):
+    """Turn scored frames into timed chord detections above the confidence threshold"""
+    chords = []
+    for frame_index, chord, score in scored_frames:
+        if score > threshold:
+            chords.append({
+                'chord': chord,
+                'time': float(frame_index * hop_length / sr),
+                'confidence': float(min(1.0, max(threshold, score)))
+            })
+    return chords
+
+
+def group_chords(chords, max_duration):
+    """Group consecutive identical chords and drop ones shorter than MIN_CHORD_DURATION"""
+    grouped = []
+    current_chord = None
+    current_start = 0
+
+    for c in chords:
+        if c['chord'] != current_chord:
+            if current_chord:
+                grouped.append({
+                    'chord': current_chord,
+                    'time': current_start,
+                    'confidence': c['confidence']
+                })
+            current_chord = c['chord']
+            current_start = c['time']
+
+    # Add final chord
+    if current_chord:
+        grouped.append({
+            'chord': current_chord,
+            'time': current_start,
+            'confidence': 0.7
+        })
+
+    # Filter by minimum duration
+    filtered = []
+    for i, c in enumerate(grouped):
+        next_time = grouped[i + 1]['time'] if i + 1 < len(grouped) else max_duration
+        if next_time - c['time'] >= MIN_CHORD_DURATION:
+            filtered.append(c)
+
+    return filtered
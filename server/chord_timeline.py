@@ -0,0 +1,87 @@
+"""
+Sorted time index over a stored chord timeline for windowed playback queries
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+TIMELINE_CACHE_SIZE = 512
+
+
+class ChordTimeline:
+    """Chord segments of one song with O(log n) lookups by playback time"""
+
+    def __init__(self, chords, record=None):
+        self.chords = sorted(chords, key=lambda c: c['time'])
+        self.starts = [c['time'] for c in self.chords]
+        record = record or {}
+        self.title = record.get('title')
+        self.duration = record.get('duration')
+        self.analyzer_version = record.get('analyzer_version')
+        self.tier = record.get('tier', 'full')
+        self.revision = record.get('revision')
+
+    def __len__(self):
+        return len(self.chords)
+
+    def _segment(self, i):
+        return dict(self.chords[i], index=i)
+
+    def index_at(self, t):
+        """Index of the chord playing at time t, or -1 before the first chord"""
+        return bisect.bisect_right(self.starts, t) - 1
+
+    def chord_at(self, t):
+        """The chord playing at time t plus when the next one starts"""
+        i = self.index_at(t)
+        if i < 0:
+            return None
+        return {
+            'chord': self._segment(i),
+            'next_time': self.starts[i + 1] if i + 1 < len(self.starts) else None
+        }
+
+    def window(self, start, end):
+        """Segments sounding anywhere in [start, end)"""
+        first = max(0, self.index_at(start))
+        last = bisect.bisect_left(self.starts, end)
+        return [self._segment(i) for i in range(first, last)]
+
+
+class TimelineCache:
+    """
+    LRU of built timelines over an AnalysisStore.
+
+    Entries are checked against the stored file's version on every hit, so a
+    re-analysis written by any worker process is picked up without parsing
+    the full record again for unchanged songs.
+    """
+
+    def __init__(self, store, size=TIMELINE_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Timeline for a stored song, or None if it has not been analyzed"""
+        version = self.store.version(key)
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        record = self.store.get(key)
+        if record is None:
+            return None
+        timeline = ChordTimeline(record['chords'], record)
+        with self._lock:
+            self._entries[key] = (version, timeline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return timeline
@@ -0,0 +1,394 @@
+"""
+Audio fingerprints for recognizing re-uploads of an already analyzed song
+
+A fingerprint is built from the first FINGERPRINT_SECONDS of audio. Local
+maxima of the log spectrogram are picked (a capped number per second), and
+each peak is paired with a few later peaks nearby in frequency; a hash of
+(anchor bin, target bin, time gap) together with the anchor frame is one
+landmark. Landmarks describe the actual spectral content of the recording,
+not just its chords, so different songs over the same progression do not
+collide. A query votes for exact (song, frame offset) pairs, so the same
+recording matches even when a lyric video or re-upload starts a few seconds
+earlier or later.
+
+Only the MAX_LANDMARKS landmarks with the lowest scrambled hash are kept.
+The choice depends on the hash value alone, so two copies of a recording
+keep the same landmarks and the share of matching ones does not drop.
+
+The fingerprint also keeps a coarse chroma summary. A candidate from the
+vote is only accepted after verify_alignment cross-correlates the two
+summaries at the voted offset.
+
+Fingerprints are stored apart from the analysis records, as small .npz
+files (a few KB each), and the index keeps its entries in sorted numpy
+arrays rather than one Python object per landmark.
+"""
+
+import os
+import re
+import threading
+import tempfile
+
+import numpy as np
+
+FINGERPRINT_VERSION = 3
+FINGERPRINT_SECONDS = float(os.environ.get('FINGERPRINT_SECONDS', 30))
+FINGERPRINT_SR = 11025
+FINGERPRINT_N_FFT = 1024
+FINGERPRINT_HOP = 256
+FRAME_SECONDS = FINGERPRINT_HOP / FINGERPRINT_SR
+
+# Peak picking: neighbourhood (bins, frames), loudness floor and density cap
+PEAK_NEIGHBORHOOD = (15, 11)
+PEAK_FLOOR_DB = -60
+PEAKS_PER_SECOND = 30
+# Pairing: each anchor with up to FAN_OUT later peaks within the target zone
+FAN_OUT = 5
+MAX_PAIR_FRAMES = 63  # ~1.5s
+MAX_PAIR_BINS = 100
+# Landmarks kept per fingerprint, chosen by hash value (about a quarter of a dense track)
+MAX_LANDMARKS = int(os.environ.get('FINGERPRINT_MAX_LANDMARKS', 1024))
+
+MIN_MATCH_VOTES = 20
+# Share of the query hashes that must vote for the winning offset. Lossy re-uploads of
+# the same recording land 20-80% of them there; different songs stay around 1%
+MIN_MATCH_RATIO = 0.1
+
+# Chroma summary used to verify candidates: one averaged column per block
+CHROMA_HOP = 512
+CHROMA_BLOCK_FRAMES = 4  # ~0.19s
+BLOCK_SECONDS = CHROMA_HOP * CHROMA_BLOCK_FRAMES / FINGERPRINT_SR
+MIN_VERIFY_BLOCKS = 30
+MIN_VERIFY_SIMILARITY = 0.9
+
+
+def _peaks(y, sr):
+    """(frame, bin) of the strongest spectral peaks, at most PEAKS_PER_SECOND per second"""
+    import librosa
+    from scipy.ndimage import maximum_filter
+
+    spectrum = librosa.amplitude_to_db(
+        np.abs(librosa.stft(y, n_fft=FINGERPRINT_N_FFT, hop_length=FINGERPRINT_HOP)), ref=np.max
+    )
+    is_peak = (maximum_filter(spectrum, size=PEAK_NEIGHBORHOOD) == spectrum) & (spectrum > PEAK_FLOOR_DB)
+    bins, frames = np.nonzero(is_peak)
+    strength = spectrum[bins, frames]
+
+    # Strongest peaks first within each one-second block
+    frames_per_second = int(round(sr / FINGERPRINT_HOP))
+    block = frames // frames_per_second
+    order = np.lexsort((-strength, block))
+    block, bins, frames = block[order], bins[order], frames[order]
+    block_start = np.searchsorted(block, block)
+    keep = np.arange(len(block)) - block_start < PEAKS_PER_SECOND
+
+    peaks = sorted(zip(frames[keep].tolist(), bins[keep].tolist()))
+    return peaks
+
+
+def _scramble(hashes):
+    """Knuth multiplicative hash: spreads landmark hashes evenly over uint32"""
+    return (hashes.astype(np.uint64) * 2654435761) & 0xFFFFFFFF
+
+
+def _landmarks(peaks):
+    """(hashes uint32, anchor frames int32), thinned to at most MAX_LANDMARKS"""
+    hashes, frames = [], []
+    for i, (t1, f1) in enumerate(peaks):
+        paired = 0
+        for t2, f2 in peaks[i + 1:]:
+            dt = t2 - t1
+            if dt > MAX_PAIR_FRAMES:
+                break
+            if dt < 1 or abs(f2 - f1) > MAX_PAIR_BINS:
+                continue
+            hashes.append((f1 << 17) | (f2 << 7) | dt)
+            frames.append(t1)
+            paired += 1
+            if paired >= FAN_OUT:
+                break
+
+    hashes = np.array(hashes, dtype=np.uint32)
+    frames = np.array(frames, dtype=np.int32)
+    if len(hashes) > MAX_LANDMARKS:
+        keep = np.sort(np.argsort(_scramble(hashes), kind='stable')[:MAX_LANDMARKS])
+        hashes, frames = hashes[keep], frames[keep]
+    return hashes, frames
+
+
+def _chroma_summary(y, sr):
+    """(blocks, 12) uint8 chroma; verification only compares directions, so 8 bits are plenty"""
+    import librosa
+
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, hop_length=CHROMA_HOP)
+    blocks = chroma.shape[1] // CHROMA_BLOCK_FRAMES
+    summary = chroma[:, :blocks * CHROMA_BLOCK_FRAMES].reshape(12, blocks, CHROMA_BLOCK_FRAMES).mean(axis=2)
+    return np.round(np.clip(summary.T, 0, 1) * 255).astype(np.uint8)
+
+
+def compute_fingerprint(audio_path, seconds=FINGERPRINT_SECONDS):
+    """Return {"version", "hashes", "frames", "chroma"} (numpy arrays) for the start of a track"""
+    import librosa
+
+    y, sr = librosa.load(audio_path, sr=FINGERPRINT_SR, mono=True, duration=seconds)
+    if len(y) == 0:
+        return {}
+    hashes, frames = _landmarks(_peaks(y, sr))
+    return {
+        "version": FINGERPRINT_VERSION,
+        "hashes": hashes,
+        "frames": frames,
+        "chroma": _chroma_summary(y, sr)
+    }
+
+
+def _current(fingerprint):
+    """(hashes, frames) of a current-version fingerprint; older formats have none"""
+    if isinstance(fingerprint, dict) and fingerprint.get('version') == FINGERPRINT_VERSION:
+        hashes = np.asarray(fingerprint.get('hashes', ()), dtype=np.uint32)
+        frames = np.asarray(fingerprint.get('frames', ()), dtype=np.int32)
+        if len(hashes) and len(hashes) == len(frames):
+            return hashes, frames
+    return None
+
+
+def verify_alignment(query, candidate, offset_seconds):
+    """
+    Confirm a vote winner: the chroma summaries must agree block by block once
+    the candidate is moved by offset_seconds.
+    """
+    if not (isinstance(query, dict) and isinstance(candidate, dict)):
+        return False
+    a = np.asarray(query.get('chroma', ()), dtype=float)
+    b = np.asarray(candidate.get('chroma', ()), dtype=float)
+    if a.ndim != 2 or b.ndim != 2:
+        return False
+
+    # Query block i lines up with candidate block i - shift
+    shift = int(round(offset_seconds / BLOCK_SECONDS))
+    start = max(0, shift)
+    end = min(len(a), len(b) + shift)
+    if end - start < MIN_VERIFY_BLOCKS:
+        return False
+    a, b = a[start:end], b[start - shift:end - shift]
+
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    voiced = norms > 1e-6
+    if voiced.sum() < MIN_VERIFY_BLOCKS:
+        return False
+    similarity = float(np.mean(np.sum(a[voiced] * b[voiced], axis=1) / norms[voiced]))
+    return similarity >= MIN_VERIFY_SIMILARITY
+
+
+_UNSAFE_KEY_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+class FingerprintStore:
+    """
+    Fingerprints on disk, one .npz per song next to (not inside) the analysis
+    records, so reading a record never parses thousands of landmarks
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, _UNSAFE_KEY_CHARS.sub('_', key) + '.npz')
+
+    def get(self, key):
+        """Return the stored fingerprint for key, or None"""
+        try:
+            with np.load(self._path(key)) as data:
+                return {
+                    "version": int(data['version']),
+                    "hashes": data['hashes'],
+                    "frames": data['frames'],
+                    "chroma": data['chroma']
+                }
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, fingerprint):
+        """Write atomically, like the analysis store"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    version=np.int32(fingerprint['version']),
+                    hashes=np.asarray(fingerprint['hashes'], dtype=np.uint32),
+                    frames=np.asarray(fingerprint['frames'], dtype=np.uint16),
+                    chroma=np.asarray(fingerprint['chroma'], dtype=np.uint8)
+                )
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class _Segment:
+    """Index entries sorted by hash: parallel hash / song id / frame arrays"""
+
+    def __init__(self, hashes=None, songs=None, frames=None):
+        self.hashes = np.empty(0, np.uint32) if hashes is None else hashes
+        self.songs = np.empty(0, np.int32) if songs is None else songs
+        self.frames = np.empty(0, np.uint16) if frames is None else frames
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @classmethod
+    def build(cls, parts):
+        """Sorted segment from unsorted (hashes, songs, frames) parts"""
+        if not parts:
+            return cls()
+        hashes, songs, frames = (np.concatenate(column) for column in zip(*parts))
+        order = np.argsort(hashes, kind='stable')
+        return cls(hashes[order], songs[order], frames[order])
+
+    def merged(self, other, alive):
+        """One sorted segment holding both, without entries of removed songs (linear time)"""
+        if not len(self):
+            keep = alive[other.songs]
+            return _Segment(other.hashes[keep], other.songs[keep], other.frames[keep])
+        at = np.searchsorted(self.hashes, other.hashes, side='right')
+        hashes = np.insert(self.hashes, at, other.hashes)
+        songs = np.insert(self.songs, at, other.songs)
+        frames = np.insert(self.frames, at, other.frames)
+        keep = alive[songs]
+        return _Segment(hashes[keep], songs[keep], frames[keep])
+
+    def lookup(self, hashes, frames):
+        """(song ids, frame offsets) of every entry sharing a hash with the query"""
+        lo = np.searchsorted(self.hashes, hashes, side='left')
+        hi = np.searchsorted(self.hashes, hashes, side='right')
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, np.int32), np.empty(0, np.int32)
+        # Positions lo[i] .. hi[i]-1 for every query hash, flattened
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        positions = starts + np.arange(total)
+        offsets = np.repeat(frames, counts) - self.frames[positions]
+        return self.songs[positions], offsets
+
+
+class FingerprintIndex:
+    """
+    In-memory landmark index mapping hashes to (song, frame).
+
+    New songs land in a small pending list that is sorted on the next match;
+    once it holds MERGE_ENTRIES entries it is merged into the main sorted
+    segment. Removed or replaced songs are only marked dead and dropped at
+    the next merge.
+    """
+
+    MERGE_ENTRIES = 1 << 18
+
+    def __init__(self):
+        self._ids = {}  # song key -> live song id
+        self._keys = []  # song id -> song key
+        self._alive = np.zeros(0, dtype=bool)
+        self._main = _Segment()
+        self._pending = []
+        self._pending_entries = 0
+        self._recent = None  # sorted view of _pending, rebuilt after adds
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, key, fingerprint):
+        with self._lock:
+            self._add_locked(key, fingerprint)
+            if self._pending_entries >= self.MERGE_ENTRIES:
+                self._main = self._main.merged(_Segment.build(self._pending), self._alive)
+                self._pending = []
+                self._pending_entries = 0
+
+    def load(self, items):
+        """Bulk-add (key, fingerprint) pairs with a single sort, for startup"""
+        with self._lock:
+            for key, fingerprint in items:
+                self._add_locked(key, fingerprint)
+            self._main = self._main.merged(_Segment.build(self._pending), self._alive)
+            self._pending = []
+            self._pending_entries = 0
+
+    def _add_locked(self, key, fingerprint):
+        self._remove_locked(key)
+        landmarks = _current(fingerprint)
+        if landmarks is None:
+            return
+        hashes, frames = landmarks
+        song = len(self._keys)
+        self._keys.append(key)
+        self._ids[key] = song
+        if song >= len(self._alive):
+            self._alive = np.concatenate([self._alive, np.zeros(max(1024, song), dtype=bool)])
+        self._alive[song] = True
+        self._pending.append((hashes, np.full(len(hashes), song, dtype=np.int32), frames.astype(np.uint16)))
+        self._pending_entries += len(hashes)
+        self._recent = None
+
+    def remove(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        song = self._ids.pop(key, None)
+        if song is not None:
+            self._alive[song] = False
+
+    def _segments_locked(self):
+        if self._recent is None:
+            self._recent = _Segment.build(self._pending)
+        return self._main, self._recent
+
+    def match(self, fingerprint, exclude=None):
+        """
+        Find the indexed song this fingerprint most likely belongs to.
+
+        Returns (key, offset_seconds, votes) or None. offset_seconds is how
+        much later the song starts in the query than in the indexed track,
+        i.e. what to add to the indexed track's chord times. Callers confirm
+        the candidate with verify_alignment before trusting it.
+        """
+        landmarks = _current(fingerprint)
+        if landmarks is None:
+            return None
+        hashes, frames = landmarks
+
+        with self._lock:
+            found = [segment.lookup(hashes, frames) for segment in self._segments_locked()]
+            songs = np.concatenate([songs for songs, _ in found])
+            offsets = np.concatenate([offsets for _, offsets in found])
+            live = self._alive[songs]
+            if exclude in self._ids:
+                live &= songs != self._ids[exclude]
+            songs, offsets = songs[live], offsets[live]
+            if len(songs) == 0:
+                return None
+
+            # One vote per (song, exact offset) pair
+            pairs, counts = np.unique(
+                (songs.astype(np.int64) << 32) | (offsets.astype(np.int64) & 0xFFFFFFFF),
+                return_counts=True
+            )
+            best = int(np.argmax(counts))
+            count = int(counts[best])
+            song = int(pairs[best] >> 32)
+            delta = int(np.int32(np.uint32(pairs[best] & 0xFFFFFFFF)))
+            key = self._keys[song]
+
+        if count < MIN_MATCH_VOTES or count < MIN_MATCH_RATIO * len(hashes):
+            return None
+        return key, delta * FRAME_SECONDS, count
@@ -0,0 +1,242 @@
+"""
+End-to-end load test for /api/analyze-song, runnable with no network
+
+By default this starts the API in-process with AUDIO_SOURCE=fake, so audio
+comes from fixture files instead of YouTube, then drives it at the requested
+concurrency and reports throughput, latency percentiles, error and
+mock-fallback rates, cache and fingerprint hit rates, and peak memory per
+server worker.
+
+There are only a few fixture songs, so after their first analysis the
+fingerprint index would answer every unique ID from the stored result. The
+in-process server therefore runs with FINGERPRINT_MATCHING=0 unless
+--fingerprint-hits is given, so the numbers describe full analyses.
+
+    python load_test.py --make-fixtures            # synthesize fixture songs once
+    python load_test.py --requests 40 --concurrency 4
+    python load_test.py --base-url http://127.0.0.1:5000 --requests 100
+
+Against an external server, start it with AUDIO_SOURCE=fake (and a
+FAKE_AUDIO_DIR) to keep it offline, and FINGERPRINT_MATCHING=0 to measure
+full analyses; worker memory is read from /api/metrics.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'audio')
+
+FIXTURE_PROGRESSIONS = {
+    'pop-loop': ['C', 'G', 'Am', 'F'],
+    'minor-rock': ['Em', 'C', 'G', 'D'],
+    'ballad': ['D', 'Bm', 'G', 'A'],
+    'blues-ish': ['A', 'D', 'E', 'D']
+}
+NOTE_FREQUENCIES = {'C': 261.63, 'D': 293.66, 'E': 329.63, 'F': 349.23, 'G': 392.00, 'A': 440.00, 'B': 493.88}
+
+
+def make_fixtures(fixture_dir, seconds=180, sr=22050):
+    """Write a few synthetic chord-progression songs so the fake source has audio to serve"""
+    import numpy as np
+    import soundfile as sf
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for name, progression in FIXTURE_PROGRESSIONS.items():
+        chord_seconds = 2.5
+        t = np.arange(int(sr * chord_seconds)) / sr
+        segments = []
+        for i in range(int(seconds / chord_seconds)):
+            chord = progression[i % len(progression)]
+            root = NOTE_FREQUENCIES[chord[0]]
+            third = root * (2 ** (3 / 12) if chord.endswith('m') else 2 ** (4 / 12))
+            fifth = root * 2 ** (7 / 12)
+            tone = sum(np.sin(2 * np.pi * f * t) for f in (root / 2, third, fifth))
+            segments.append(0.2 * tone + 0.01 * rng.standard_normal(len(t)))
+        path = os.path.join(fixture_dir, f"{name}.wav")
+        sf.write(path, np.concatenate(segments).astype(np.float32), sr)
+        print(f"🧪 Wrote fixture {path}")
+
+
+def start_local_server(data_dir, fingerprint_hits=False):
+    """Run the API in a background thread with the fake audio source"""
+    os.environ.setdefault('AUDIO_SOURCE', 'fake')
+    os.environ.setdefault('DATA_DIR', data_dir)
+    os.environ.setdefault('FINGERPRINT_MATCHING', '1' if fingerprint_hits else '0')
+    from werkzeug.serving import make_server
+    import app as api
+
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class MemorySampler:
+    """Polls /api/metrics and keeps the peak RSS reported by each worker pid"""
+
+    def __init__(self, base_url, interval=0.5):
+        self.base_url = base_url
+        self.interval = interval
+        self.workers = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                metrics = requests.get(f"{self.base_url}/api/metrics", timeout=5).json()
+                memory = metrics.get('memory', {})
+                worker = self.workers.setdefault(metrics['pid'], {'peak_rss_mb': 0.0})
+                worker['peak_rss_mb'] = max(
+                    worker['peak_rss_mb'], memory.get('peak_rss_mb') or 0.0, memory.get('rss_mb') or 0.0
+                )
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.workers
+
+
+def run_load(base_url, total, concurrency, unique_ratio, deadline_seconds):
+    """Fire total analyze-song requests at the given concurrency"""
+    repeat_ids = [uuid.uuid4().hex[:11] for _ in range(max(1, concurrency))]
+
+    def one_request(_):
+        if random.random() < unique_ratio:
+            video_id = uuid.uuid4().hex[:11]
+        else:
+            video_id = random.choice(repeat_ids)
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{base_url}/api/analyze-song",
+                json={'url': f"https://www.youtube.com/watch?v={video_id}", 'deadline_seconds': deadline_seconds},
+                timeout=deadline_seconds + 30
+            )
+            body = response.json()
+            status = response.status_code
+        except Exception as e:
+            body, status = {'error': str(e)}, None
+        return {
+            'latency': time.perf_counter() - started,
+            'status': status,
+            'ok': status == 200 and body.get('status') == 'success',
+            'mock_fallback': str(body.get('analysis_type', '')).startswith('mock_fallback'),
+            'cached': bool(body.get('cached')),
+            'fingerprint_hit': body.get('cache_source') == 'fingerprint'
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(total)))
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, workers):
+    latencies = sorted(r['latency'] for r in results)
+    total = len(results)
+    ok = [r for r in results if r['ok']]
+    status_counts = {}
+    for r in results:
+        status_counts[str(r['status'])] = status_counts.get(str(r['status']), 0) + 1
+    return {
+        'requests': total,
+        'elapsed_seconds': round(elapsed, 2),
+        'requests_per_second': round(total / elapsed, 2) if elapsed else None,
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None
+        },
+        'error_rate': round(1 - len(ok) / total, 4) if total else None,
+        'mock_fallback_rate': round(sum(r['mock_fallback'] for r in results) / total, 4) if total else None,
+        'cache_hit_rate': round(sum(r['cached'] for r in ok) / len(ok), 4) if ok else None,
+        'fingerprint_hit_rate': round(sum(r['fingerprint_hit'] for r in ok) / len(ok), 4) if ok else None,
+        'status_codes': status_counts,
+        'workers': {str(pid): {'peak_rss_mb': round(w['peak_rss_mb'], 1)} for pid, w in workers.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for /api/analyze-song')
+    parser.add_argument('--base-url', help='Existing server to test; default starts one in-process')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--unique-ratio', type=float, default=1.0,
+                        help='Share of requests using a never-seen video ID (the rest repeat, hitting the cache)')
+    parser.add_argument('--deadline', type=float, default=120.0)
+    parser.add_argument('--fixture-dir', default=os.environ.get('FAKE_AUDIO_DIR', DEFAULT_FIXTURE_DIR))
+    parser.add_argument('--make-fixtures', action='store_true', help='Synthesize fixture songs and exit')
+    parser.add_argument('--fingerprint-hits', action='store_true',
+                        help='Let the in-process server answer repeated fixture audio from fingerprints')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON only')
+    args = parser.parse_args()
+
+    if args.make_fixtures:
+        make_fixtures(args.fixture_dir)
+        return
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        os.environ.setdefault('FAKE_AUDIO_DIR', args.fixture_dir)
+        server, base_url = start_local_server(tempfile.mkdtemp(prefix='chordslegend-load-'), args.fingerprint_hits)
+
+    sampler = MemorySampler(base_url).start()
+    try:
+        results, elapsed = run_load(base_url, args.requests, args.concurrency, args.unique_ratio, args.deadline)
+    finally:
+        workers = sampler.stop()
+        if server:
+            server.shutdown()
+
+    report = summarize(results, elapsed, workers)
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print("📊 === Load test report ===")
+    print(f"Requests: {report['requests']} in {report['elapsed_seconds']}s "
+          f"({report['requests_per_second']} req/s, concurrency {args.concurrency})")
+    latency = report['latency_seconds']
+    if latency['p50'] is not None:
+        print(f"Latency: p50={latency['p50']:.2f}s p95={latency['p95']:.2f}s "
+              f"p99={latency['p99']:.2f}s max={latency['max']:.2f}s")
+    print(f"Error rate: {report['error_rate']:.2%}  Mock fallback rate: {report['mock_fallback_rate']:.2%}")
+    if report['cache_hit_rate'] is not None:
+        print(f"Cache hit rate: {report['cache_hit_rate']:.2%}  "
+              f"Fingerprint hit rate: {report['fingerprint_hit_rate']:.2%}")
+    print(f"Status codes: {report['status_codes']}")
+    for pid, worker in report['workers'].items():
+        print(f"Worker {pid}: peak RSS {worker['peak_rss_mb']} MB")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
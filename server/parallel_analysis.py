@@ -0,0 +1,200 @@
+"""
+Multi-core chroma analysis for a single long track
+
+The decoded signal is copied once into a shared memory block. Each worker
+attaches to it by name and analyzes one window of frames plus an overlap
+margin on both sides, so the CQT filters at the window edges see the same
+samples as in a serial pass. Only the frames inside each window's core range
+are kept, which makes the stitched timeline line up with the serial result.
+
+Run directly to measure speedup against worker count:
+
+    python parallel_analysis.py song.m4a --workers 1 2 4 8
+"""
+
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from chord_analysis import SAMPLE_RATE, HOP_LENGTH, FRAME_STEP, compute_chroma, score_frames
+
+WINDOW_SECONDS = float(os.environ.get('ANALYSIS_WINDOW_SECONDS', 30))
+# Longest CQT filter (lowest bin) is ~1.6s at 22050Hz; leave plenty of room
+OVERLAP_SECONDS = float(os.environ.get('ANALYSIS_OVERLAP_SECONDS', 5))
+
+# The pool is created from request threads after numpy/librosa/numba started their own
+# thread pools; forking that process can deadlock, so workers come from a clean forkserver
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Warm pools by worker count. Request threads call _get_executor concurrently, so
+# creation happens under a lock, and a pool is never shut down while the process runs
+# because another request may still be submitting to it
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    """Keep one warm pool so librosa is only imported once per worker process"""
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            context = multiprocessing.get_context(START_METHOD)
+            if START_METHOD == 'forkserver':
+                # Workers fork from a server that already imported the heavy modules
+                context.set_forkserver_preload(['parallel_analysis'])
+            executor = _executors[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return executor
+
+
+@atexit.register
+def _shutdown_executor():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def plan_windows(n_samples, sr, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """
+    Split a signal into analysis windows aligned to the hop grid.
+
+    Returns (first_frame, last_frame, start_sample, end_sample) tuples; frames
+    [first_frame, last_frame) are the window's core, and the sample range
+    includes the overlap margin.
+    """
+    n_frames = 1 + n_samples // HOP_LENGTH  # chroma_cqt is centered
+    core_frames = max(FRAME_STEP, int(window_seconds * sr / HOP_LENGTH) // FRAME_STEP * FRAME_STEP)
+    margin_frames = int(np.ceil(overlap_seconds * sr / HOP_LENGTH))
+
+    windows = []
+    for first in range(0, n_frames, core_frames):
+        last = min(first + core_frames, n_frames)
+        start = max(0, first - margin_frames) * HOP_LENGTH
+        end = min(n_samples, (last + margin_frames) * HOP_LENGTH)
+        windows.append((first, last, start, end))
+    return windows
+
+
+def _analyze_window(shm_name, n_samples, sr, tuning, window):
+    """Worker: chroma and template scores for one window of the shared signal"""
+    first, last, start, end = window
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        y = np.ndarray((n_samples,), dtype=np.float32, buffer=shm.buf)
+        chroma = compute_chroma(y[start:end], sr, tuning=tuning)
+        offset = start // HOP_LENGTH
+        first_sampled = -(-first // FRAME_STEP) * FRAME_STEP
+        frames = [f for f in range(first_sampled, last, FRAME_STEP) if f - offset < chroma.shape[1]]
+        scored = score_frames(chroma, [f - offset for f in frames])
+        # Translate local column indices back onto the global frame grid
+        result = [(f, chord, score) for f, (_, chord, score) in zip(frames, scored)]
+        del y
+        return result
+    finally:
+        shm.close()
+
+
+def analyze_signal_parallel(y, sr, workers, tuning=None, deadline=None):
+    """
+    Score every FRAME_STEP-th chroma frame of y using a process pool.
+
+    Returns the same (frame_index, chord, score) list a serial
+    score_frames(compute_chroma(y, sr), ...) pass would produce. With a
+    deadline, it is checked as each window finishes and windows not yet
+    started are dropped on cancellation.
+    """
+    import librosa
+
+    y = np.ascontiguousarray(y, dtype=np.float32)
+    if tuning is None:
+        # Estimated once over the whole track, as the serial pass does
+        tuning = float(librosa.estimate_tuning(y=y, sr=sr, bins_per_octave=36))
+
+    windows = plan_windows(len(y), sr)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, y.nbytes))
+    try:
+        shared = np.ndarray(y.shape, dtype=np.float32, buffer=shm.buf)
+        shared[:] = y
+        del shared
+
+        executor = _get_executor(workers)
+        futures = [
+            executor.submit(_analyze_window, shm.name, len(y), sr, tuning, window)
+            for window in windows
+        ]
+        try:
+            scored = []
+            for future in futures:
+                if deadline:
+                    deadline.check('chroma')
+                scored.extend(future.result())
+            return scored
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # Running windows still read the shared buffer; let them finish before unlinking
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+            raise
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def analyze_serial(y, sr):
+    """Reference single-core pass over the whole signal"""
+    chroma = compute_chroma(y, sr)
+    return score_frames(chroma, range(0, chroma.shape[1], FRAME_STEP))
+
+
+def benchmark_scaling(audio_path, worker_counts=(1, 2, 4, 8), duration=None):
+    """Time the serial pass and the parallel pass at each worker count"""
+    import librosa
+
+    y, sr = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True, duration=duration)
+    print(f"🎵 Loaded {len(y)/sr:.1f}s of audio, {len(plan_windows(len(y), sr))} windows")
+
+    # Warm librosa's filter caches before timing anything
+    analyze_serial(y[:sr * 10], sr)
+    start = time.perf_counter()
+    serial = analyze_serial(y, sr)
+    serial_time = time.perf_counter() - start
+    print(f"serial: {serial_time:.2f}s")
+
+    results = []
+    for workers in worker_counts:
+        # Warm the pool so process startup is not counted
+        analyze_signal_parallel(y[:sr * 10], sr, workers)
+        start = time.perf_counter()
+        parallel = analyze_signal_parallel(y, sr, workers)
+        elapsed = time.perf_counter() - start
+        mismatches = abs(len(serial) - len(parallel))
+        mismatches += sum(1 for a, b in zip(serial, parallel) if a[1] != b[1])
+        max_score_diff = max((abs(a[2] - b[2]) for a, b in zip(serial, parallel)), default=0.0)
+        results.append({
+            'workers': workers,
+            'seconds': elapsed,
+            'speedup': serial_time / elapsed if elapsed else 0.0,
+            'chord_mismatches': mismatches,
+            'max_score_diff': max_score_diff
+        })
+        print(f"workers={workers}: {elapsed:.2f}s speedup={serial_time / elapsed:.2f}x "
+              f"mismatches={mismatches} max_score_diff={max_score_diff:.2e}")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure parallel chord analysis speedup')
+    parser.add_argument('audio_path')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=None)
+    args = parser.parse_args()
+    benchmark_scaling(args.audio_path, args.workers, args.duration)
@@ -0,0 +1,188 @@
+"""
+Inverted index over transposition-normalized chord n-grams
+
+Every chord is reduced to (root pitch class, quality). An n-gram is stored
+relative to its first chord's root, so C-G-Am-F and D-A-Bm-G share the same
+key, and roman numeral queries like I-V-vi-IV map onto the same space.
+"""
+
+import re
+import math
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+NGRAM_SIZE = 4
+MIN_NGRAM_SIZE = 2
+# Song-to-song queries only look at the most distinctive n-grams of the seed song
+MAX_QUERY_NGRAMS = 32
+
+NOTE_PITCHES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+NUMERAL_DEGREES = {'I': 0, 'II': 2, 'III': 4, 'IV': 5, 'V': 7, 'VI': 9, 'VII': 11}
+
+CHORD_PATTERN = re.compile(r'^([A-G])([#b]?)(.*)$')
+NUMERAL_PATTERN = re.compile(r'^([#b]?)(VII|VI|IV|V|III|II|I|vii|vi|iv|v|iii|ii|i)(.*)$')
+
+
+def _quality(suffix):
+    """Collapse a chord suffix to maj/min/dim; sevenths and extensions keep their triad"""
+    if suffix.startswith(('dim', 'o', '°')):
+        return 'dim'
+    if suffix.startswith('m') and not suffix.startswith('maj'):
+        return 'min'
+    return 'maj'
+
+
+def parse_chord(name):
+    """'F#m7' -> (6, 'min'); returns None for anything unrecognized"""
+    match = CHORD_PATTERN.match((name or '').strip())
+    if not match:
+        return None
+    letter, accidental, suffix = match.groups()
+    root = NOTE_PITCHES[letter] + {'#': 1, 'b': -1}.get(accidental, 0)
+    return root % 12, _quality(suffix)
+
+
+def parse_numeral(numeral):
+    """'vi' -> (9, 'min'), 'bVII' -> (10, 'maj'); returns None for anything unrecognized"""
+    match = NUMERAL_PATTERN.match((numeral or '').strip())
+    if not match:
+        return None
+    accidental, degree, suffix = match.groups()
+    root = NUMERAL_DEGREES[degree.upper()] + {'#': 1, 'b': -1}.get(accidental, 0)
+    quality = _quality(suffix) if suffix else ('maj' if degree.isupper() else 'min')
+    if degree.islower() and quality == 'maj' and not suffix.startswith('maj'):
+        quality = 'min'
+    return root % 12, quality
+
+
+def parse_progression(text):
+    """Parse 'I-V-vi-IV' or 'C G Am F' into a list of (root, quality)"""
+    tokens = [t for t in re.split(r'[\s,\-|>]+', text or '') if t]
+    parsed = []
+    for token in tokens:
+        chord = parse_numeral(token) or parse_chord(token)
+        if chord is None:
+            raise ValueError(f"Unrecognized chord or numeral: {token}")
+        parsed.append(chord)
+    return parsed
+
+
+def chord_sequence(chords):
+    """Parsed chord sequence of a stored timeline with repeated chords collapsed"""
+    sequence = []
+    for chord in chords:
+        parsed = parse_chord(chord.get('chord') if isinstance(chord, dict) else chord)
+        if parsed and (not sequence or sequence[-1] != parsed):
+            sequence.append(parsed)
+    return sequence
+
+
+def normalized_ngrams(sequence, n=NGRAM_SIZE, cyclic=False):
+    """Transposition-invariant n-grams of a parsed chord sequence"""
+    if len(sequence) < n:
+        return []
+    if cyclic:
+        sequence = sequence + sequence[:n - 1]
+    ngrams = []
+    for i in range(len(sequence) - n + 1):
+        base = sequence[i][0]
+        ngrams.append(tuple(((root - base) % 12, quality) for root, quality in sequence[i:i + n]))
+    return ngrams
+
+
+class ProgressionIndex:
+    """n-gram -> {song key: occurrences}, updated as analyses complete"""
+
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self._postings = defaultdict(dict)
+        self._songs = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._songs)
+
+    def add(self, key, chords, title=None):
+        counts = Counter(normalized_ngrams(chord_sequence(chords), self.n))
+        with self._lock:
+            self._remove_locked(key)
+            self._songs[key] = {'title': title, 'ngrams': counts, 'length': sum(counts.values())}
+            for ngram, count in counts.items():
+                self._postings[ngram][key] = count
+
+    def remove(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        song = self._songs.pop(key, None)
+        if not song:
+            return
+        for ngram in song['ngrams']:
+            posting = self._postings.get(ngram)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[ngram]
+
+    def _idf(self, ngram):
+        return math.log(1 + len(self._songs) / (1 + len(self._postings.get(ngram, ()))))
+
+    def _rank(self, query_counts, limit, exclude=None):
+        scores = defaultdict(float)
+        matched = Counter()
+        for ngram, query_count in query_counts.items():
+            posting = self._postings.get(ngram)
+            if not posting:
+                continue
+            idf = self._idf(ngram)
+            for key, count in posting.items():
+                if key != exclude:
+                    scores[key] += idf * min(query_count, count)
+                    matched[key] += 1
+
+        ranked = heapq.nlargest(
+            limit,
+            ((score / math.sqrt(self._songs[key]['length']), key) for key, score in scores.items())
+        )
+        return [{
+            'video_id': key,
+            'title': self._songs[key]['title'],
+            'score': round(score, 4),
+            'matched_ngrams': matched[key]
+        } for score, key in ranked]
+
+    def query_progression(self, text, limit=20):
+        """Songs containing a progression such as 'I-V-vi-IV' or 'C G Am F'"""
+        sequence = parse_progression(text)
+        if len(sequence) < MIN_NGRAM_SIZE:
+            raise ValueError("A progression needs at least two chords")
+        # Progressions are loops, so the query wraps around
+        if len(sequence) >= self.n:
+            ngrams = normalized_ngrams(sequence, self.n, cyclic=True)
+        else:
+            ngrams = normalized_ngrams(sequence, len(sequence))
+            return self._rank_prefix(ngrams, limit)
+        with self._lock:
+            return self._rank(Counter(ngrams), limit)
+
+    def _rank_prefix(self, short_ngrams, limit):
+        """Queries shorter than n match any n-gram that starts with them"""
+        wanted = set(short_ngrams)
+        size = len(next(iter(wanted)))
+        with self._lock:
+            query_counts = Counter({
+                ngram: 1 for ngram in self._postings
+                if ngram[:size] in wanted
+            })
+            return self._rank(query_counts, limit)
+
+    def query_song(self, key, limit=20):
+        """Songs sharing the most distinctive progressions with an indexed song"""
+        with self._lock:
+            song = self._songs.get(key)
+            if song is None:
+                return None
+            distinctive = sorted(song['ngrams'], key=self._idf, reverse=True)[:MAX_QUERY_NGRAMS]
+            return self._rank({ngram: song['ngrams'][ngram] for ngram in distinctive}, limit, exclude=key)
@@ -0,0 +1,293 @@
+"""
+Background re-analysis of stored results made by an older analyzer version
+
+After ANALYZER_VERSION changes, every stored result is stale. Rather than
+waiting for users to pay the cold latency one song at a time, the scheduler
+walks the stale records, most requested first, and re-runs them on spare
+capacity:
+
+- a job only starts while foreground requests leave a slot free and then
+  holds that slot, so admission counts it; its cancellation probe stops it
+  at the next pipeline checkpoint as soon as foreground demand fills the
+  slots again (the song goes back in the queue);
+- the worker thread runs at a raised nice level where the OS allows it;
+- the new result replaces the old one through the store's atomic rename,
+  so readers see either the old or the new record, never a mix.
+
+Songs users ask for while still stale are moved to the front of the queue.
+Previews whose refinement never finished are picked up the same way.
+Only one scheduler runs per DATA_DIR, elected with a lock file; other
+workers pass urgent songs to it through a small shared file next to the
+lock.
+"""
+
+import os
+import json
+import time
+import heapq
+import threading
+import tempfile
+from collections import Counter, deque
+
+from request_control import AnalysisCancelled, AnalysisDeadline
+
+REANALYSIS_ENABLED = os.environ.get('REANALYSIS_ENABLED', '1') == '1'
+REANALYSIS_SCAN_SECONDS = float(os.environ.get('REANALYSIS_SCAN_SECONDS', 300))
+REANALYSIS_IDLE_SECONDS = float(os.environ.get('REANALYSIS_IDLE_SECONDS', 5))
+REANALYSIS_DEADLINE_SECONDS = float(os.environ.get('REANALYSIS_DEADLINE_SECONDS', 600))
+REANALYSIS_NICE = int(os.environ.get('REANALYSIS_NICE', 10))
+POPULARITY_FLUSH_SECONDS = float(os.environ.get('POPULARITY_FLUSH_SECONDS', 60))
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+class PopularityCounter:
+    """
+    Request counts per song. Hits are counted in memory and merged into a
+    shared JSON file by flush(), so counts from several workers add up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._totals = Counter()
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._totals = Counter(json.load(f))
+        except (FileNotFoundError, ValueError):
+            self._totals = Counter()
+
+    def hit(self, key):
+        if not key:
+            return
+        with self._lock:
+            self._pending[key] += 1
+            due = time.monotonic() - self._flushed_at >= POPULARITY_FLUSH_SECONDS
+        if due:
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Could not save popularity counts: {e}")
+
+    def get(self, key):
+        with self._lock:
+            return self._totals[key] + self._pending[key]
+
+    def flush(self):
+        """Merge this worker's pending hits into the shared file"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load()
+            totals = self._totals + pending
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dict(totals), f)
+            os.replace(tmp_path, self.path)
+        with self._lock:
+            self._totals = totals
+
+
+class ReanalysisScheduler:
+    """Re-runs stale stored analyses by popularity on spare capacity"""
+
+    def __init__(self, store, popularity, analyze, is_busy, current_version, lock_path):
+        self.store = store
+        self.popularity = popularity
+        self.analyze = analyze
+        self.is_busy = is_busy
+        self.current_version = current_version
+        self.lock_path = lock_path
+        self.urgent_path = lock_path + '.urgent'
+        self._queue = []
+        self._queued = set()
+        self._urgent = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        self.stats_counts = Counter()
+
+    def is_stale(self, record):
+        if not record.get('url'):
+            return False
+        if record.get('analyzer_version') != self.current_version:
+            return True
+        # A preview whose background refinement never landed (e.g. the worker restarted)
+        return (
+            record.get('tier') == 'preview'
+            and time.time() - record.get('stored_at', 0) > REANALYSIS_DEADLINE_SECONDS
+        )
+
+    def scan(self):
+        """Rebuild the popularity-ordered queue of stale records"""
+        queue = [
+            (-self.popularity.get(record['store_key']), record['store_key'])
+            for record in self.store.iter_records()
+            if self.is_stale(record)
+        ]
+        heapq.heapify(queue)
+        self._queue = queue
+        self._queued = {key for _, key in queue}
+        return len(queue)
+
+    def is_running(self):
+        """True when this process or another worker holds the scheduler lock"""
+        if self._thread is not None:
+            return True
+        if not fcntl or not os.path.exists(self.lock_path):
+            return False
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+
+    def prioritize(self, key):
+        """
+        A user asked for a stale song: re-analyze it next. Returns False when
+        no scheduler is running anywhere, so nothing would refresh it.
+        """
+        if not key:
+            return False
+        if self._thread is not None:
+            self._urgent.append(key)
+            self._wake.set()
+            return True
+        if not self.is_running():
+            return False
+        # The elected worker drains this file on its next loop
+        with open(self.urgent_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(key + '\n')
+        return True
+
+    def _take_shared_urgent(self):
+        """Move keys other workers asked for into the local urgent queue"""
+        if not fcntl or not os.path.exists(self.urgent_path):
+            return
+        with open(self.urgent_path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            keys = f.read().split()
+            f.seek(0)
+            f.truncate()
+        for key in dict.fromkeys(keys):
+            self._urgent.append(key)
+
+    def _next_key(self):
+        if self._urgent:
+            return self._urgent.popleft()
+        while self._queue:
+            _, key = heapq.heappop(self._queue)
+            if key in self._queued:
+                return key
+        return None
+
+    def run_job(self, key):
+        """Re-analyze one song; returns True when the new result was stored"""
+        record = self.store.get(key)
+        if record is None or not self.is_stale(record):
+            self._queued.discard(key)
+            return False
+
+        deadline = AnalysisDeadline(REANALYSIS_DEADLINE_SECONDS, self.is_busy, 'foreground_busy')
+        try:
+            self.analyze(record, deadline)
+        except AnalysisCancelled as e:
+            if e.reason == 'foreground_busy':
+                # Preempted by real traffic; keep its place in line
+                heapq.heappush(self._queue, (-self.popularity.get(key), key))
+                self._queued.add(key)
+                self.stats_counts['preempted'] += 1
+                return False
+            self.stats_counts['failed'] += 1
+        except Exception as e:
+            print(f"⚠️ Re-analysis of {key} failed: {e}")
+            self.stats_counts['failed'] += 1
+        else:
+            self.stats_counts['refreshed'] += 1
+            print(f"♻️ Re-analyzed {key} with analyzer v{self.current_version}")
+            self._queued.discard(key)
+            return True
+        self._queued.discard(key)
+        return False
+
+    def _lower_priority(self):
+        try:
+            # On Linux this renices only the calling thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), REANALYSIS_NICE)
+        except (AttributeError, OSError):
+            pass
+
+    def _run(self):
+        self._lower_priority()
+        last_flush = last_scan = float('-inf')
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now - last_flush >= POPULARITY_FLUSH_SECONDS:
+                try:
+                    self.popularity.flush()
+                except OSError as e:
+                    print(f"⚠️ Could not save popularity counts: {e}")
+                last_flush = now
+            try:
+                self._take_shared_urgent()
+            except OSError as e:
+                print(f"⚠️ Could not read urgent re-analysis requests: {e}")
+            if not self._queue and now - last_scan >= REANALYSIS_SCAN_SECONDS:
+                stale = self.scan()
+                last_scan = now
+                if stale:
+                    print(f"♻️ {stale} stored analyses need re-analysis")
+
+            if self.is_busy() or not (self._queue or self._urgent):
+                self._wake.wait(REANALYSIS_IDLE_SECONDS)
+                self._wake.clear()
+                continue
+
+            key = self._next_key()
+            if key:
+                self.run_job(key)
+
+    def start(self):
+        """Start the background thread unless another process already runs one"""
+        if self._thread is not None:
+            return True
+        if fcntl:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            self._lock_file = open(self.lock_path, 'w')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                print("♻️ Re-analysis scheduler already running in another worker")
+                return False
+        self._thread = threading.Thread(target=self._run, name='reanalysis', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "running": self._thread is not None,
+            "queued": len(self._queued),
+            **self.stats_counts
+        }
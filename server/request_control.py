@@ -0,0 +1,223 @@
+"""
+Deadlines, cancellation checkpoints and admission control for analyses
+
+Every analysis carries an AnalysisDeadline. The pipeline calls
+deadline.check(stage) between yt-dlp extraction, download, decode, chroma
+and matching, so abandoned work stops at the next checkpoint instead of
+running to completion. The AdmissionController caps concurrent analyses
+and rejects requests up front when the estimated queue wait already
+exceeds their deadline.
+"""
+
+import os
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_DEADLINE_SECONDS', 90))
+MAX_DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_MAX_DEADLINE_SECONDS', 300))
+ANALYSIS_CONCURRENCY = int(os.environ.get('ANALYSIS_CONCURRENCY', 2))
+# Starting guess for how long one analysis takes, refined as analyses finish
+INITIAL_ANALYSIS_SECONDS = float(os.environ.get('ANALYSIS_INITIAL_ESTIMATE_SECONDS', 30))
+DURATION_SMOOTHING = 0.2
+# How long a background job holding a slot takes to reach its next checkpoint and yield
+BACKGROUND_YIELD_SECONDS = float(os.environ.get('ANALYSIS_BACKGROUND_YIELD_SECONDS', 10))
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class AnalysisCancelled(Exception):
+    """Raised at a checkpoint once the deadline passed or the client went away"""
+
+    def __init__(self, reason, stage):
+        super().__init__(f"Analysis cancelled during {stage}: {reason}")
+        self.reason = reason
+        self.stage = stage
+
+
+class Overloaded(Exception):
+    """Raised at admission when the queue wait alone would exceed the deadline"""
+
+    def __init__(self, estimated_wait, remaining):
+        super().__init__(
+            f"Estimated queue wait {estimated_wait:.1f}s exceeds the {remaining:.1f}s deadline"
+        )
+        self.estimated_wait = estimated_wait
+        self.remaining = remaining
+
+
+def client_disconnect_probe(environ):
+    """
+    Return a callable that reports whether the client has closed its
+    connection, or None when the server does not expose the socket.
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    dontwait = getattr(socket, 'MSG_DONTWAIT', None)
+    if sock is None or dontwait is None:
+        return None
+
+    def disconnected():
+        try:
+            # An orderly shutdown from the peer reads as b'' without consuming anything
+            return sock.recv(1, socket.MSG_PEEK | dontwait) == b''
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            return False
+        except OSError:
+            return True
+
+    return disconnected
+
+
+def request_deadline_seconds(data, headers):
+    """Deadline asked for by the client (JSON or X-Request-Timeout), capped by the server"""
+    requested = data.get('deadline_seconds') or headers.get('X-Request-Timeout')
+    try:
+        seconds = float(requested) if requested else DEFAULT_DEADLINE_SECONDS
+    except (TypeError, ValueError):
+        seconds = DEFAULT_DEADLINE_SECONDS
+    return max(1.0, min(seconds, MAX_DEADLINE_SECONDS))
+
+
+class AnalysisDeadline:
+    """
+    Time budget for one analysis plus an optional stop probe. The probe is
+    normally a client-disconnect check; background work passes its own with a
+    different probe_reason.
+    """
+
+    def __init__(self, seconds, is_disconnected=None, probe_reason='client_disconnected'):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.is_disconnected = is_disconnected
+        self.probe_reason = probe_reason
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage):
+        """Cancellation checkpoint: raise AnalysisCancelled if the work is no longer wanted"""
+        if time.monotonic() >= self.expires_at:
+            raise AnalysisCancelled('deadline_exceeded', stage)
+        if self.is_disconnected is not None and self.is_disconnected():
+            raise AnalysisCancelled(self.probe_reason, stage)
+
+
+class HeldSlot:
+    """Yielded by AdmissionController.slot; the holder marks runs that analyzed audio"""
+
+    def __init__(self):
+        self.analyzed = False
+
+    def mark_analyzed(self):
+        self.analyzed = True
+
+
+class AdmissionController:
+    """Fixed number of analysis slots with deadline-aware admission"""
+
+    def __init__(self, slots=ANALYSIS_CONCURRENCY):
+        self.slots = max(1, slots)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._background = 0
+        self._average_seconds = INITIAL_ANALYSIS_SECONDS
+        self.rejected = 0
+        self.cancelled = 0
+
+    def _estimated_wait_locked(self):
+        ahead = self._active - self._background + self._waiting - self.slots + 1
+        wait = max(0, ahead) / self.slots * self._average_seconds
+        # A background job gives its slot up at its next checkpoint once requests queue
+        if self._background and self._active + self._waiting >= self.slots:
+            wait += BACKGROUND_YIELD_SECONDS
+        return wait
+
+    def foreground_busy(self):
+        """True when requests are using every slot or queueing for one"""
+        with self._cond:
+            return self._active - self._background + self._waiting >= self.slots
+
+    def estimated_wait(self):
+        with self._cond:
+            return self._estimated_wait_locked()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "active": self._active,
+                "waiting": self._waiting,
+                "background": self._background,
+                "estimated_wait_seconds": round(self._estimated_wait_locked(), 2),
+                "average_analysis_seconds": round(self._average_seconds, 2),
+                "rejected": self.rejected,
+                "cancelled": self.cancelled
+            }
+
+    @contextmanager
+    def background_slot(self):
+        """
+        Low-priority slot for background work. It is only taken when a slot is
+        free and nobody is queueing, otherwise AnalysisCancelled('foreground_busy')
+        is raised right away. While held it counts as an active analysis, so
+        requests queue behind it instead of running alongside, and the wait
+        estimate adds the time it needs to stop at its next checkpoint.
+        """
+        with self._cond:
+            if self._active + self._waiting >= self.slots:
+                raise AnalysisCancelled('foreground_busy', 'queue')
+            self._active += 1
+            self._background += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._background -= 1
+                self._cond.notify()
+
+    @contextmanager
+    def slot(self, deadline):
+        """
+        Hold an analysis slot; raises Overloaded or AnalysisCancelled instead of waiting in vain.
+        Only runs the holder marked as analyzed feed the duration estimate.
+        """
+        with self._cond:
+            wait = self._estimated_wait_locked()
+            if wait > deadline.remaining():
+                self.rejected += 1
+                raise Overloaded(wait, deadline.remaining())
+
+            self._waiting += 1
+            try:
+                while self._active >= self.slots:
+                    try:
+                        deadline.check('queue')
+                    except AnalysisCancelled:
+                        self.cancelled += 1
+                        raise
+                    self._cond.wait(timeout=min(DISCONNECT_POLL_SECONDS, deadline.remaining()))
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+        started = time.monotonic()
+        held = HeldSlot()
+        completed = False
+        try:
+            yield held
+            completed = True
+        except AnalysisCancelled:
+            with self._cond:
+                self.cancelled += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._active -= 1
+                # Cancelled runs and fast answers (catalog, stored results) would make the
+                # estimate look too optimistic
+                if completed and held.analyzed:
+                    self._average_seconds += DURATION_SMOOTHING * (elapsed - self._average_seconds)
+                self._cond.notify()
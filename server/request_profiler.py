@@ -0,0 +1,166 @@
+"""
+Opt-in sampling profiler for slow analyze-song requests
+
+A background thread samples the request thread's Python stack every
+PROFILE_INTERVAL_SECONDS and counts identical stacks. The result is saved in
+folded-stack format (one "frame;frame;frame count" line per stack), which
+flamegraph.pl, speedscope and similar tools render directly. Profiles live
+in a bounded directory next to a JSON file of request metadata.
+
+Work done inside parallel analysis worker processes is not visible here;
+it shows up as time spent waiting on the pool.
+"""
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from analysis_store import DATA_DIR
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(DATA_DIR, 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.01))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+
+_PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+
+class SamplingProfiler:
+    """Periodically records the stack of one thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+
+def profiling_token_valid(token):
+    """profile=1 only counts when it comes with the configured PROFILE_TOKEN"""
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(
+        (token or '').encode('utf-8'), PROFILE_TOKEN.encode('utf-8')
+    )
+
+
+def should_profile(requested, token):
+    """Profile when asked with a valid token, or for a random PROFILE_SAMPLE_RATE share of requests"""
+    if requested and profiling_token_valid(token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfileStore:
+    """Saved profiles, oldest deleted first once PROFILE_MAX_FILES is reached"""
+
+    def __init__(self, root=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        self.root = root
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def save(self, samples, metadata):
+        os.makedirs(self.root, exist_ok=True)
+        profile_id = time.strftime('%Y%m%dT%H%M%S', time.gmtime()) + '-' + uuid.uuid4().hex[:8]
+        metadata = dict(metadata, id=profile_id, samples=sum(samples.values()), stacks=len(samples))
+        with self._lock:
+            with open(os.path.join(self.root, profile_id + '.folded'), 'w', encoding='utf-8') as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            with open(os.path.join(self.root, profile_id + '.json'), 'w', encoding='utf-8') as f:
+                json.dump(metadata, f)
+            self._prune_locked()
+        return metadata
+
+    def _prune_locked(self):
+        ids = sorted(name[:-len('.json')] for name in os.listdir(self.root) if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - self.max_files)]:
+            for suffix in ('.json', '.folded'):
+                try:
+                    os.remove(os.path.join(self.root, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Metadata of every stored profile, newest first"""
+        if not os.path.isdir(self.root):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.root), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root, name), 'r', encoding='utf-8') as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return profiles
+
+    def folded_path(self, profile_id):
+        """Path of a stored profile, or None for unknown or malformed IDs"""
+        if not _PROFILE_ID_PATTERN.match(profile_id or ''):
+            return None
+        path = os.path.join(self.root, profile_id + '.folded')
+        return path if os.path.exists(path) else None
+
+
+@contextmanager
+def profile_request(enabled, store, metadata):
+    """
+    Sample the current thread for the duration of the block when enabled.
+    The yielded dict can be filled with more metadata before the block ends.
+    """
+    if not enabled:
+        yield {}
+        return
+
+    extra = {}
+    started = time.time()
+    profiler = SamplingProfiler(threading.get_ident()).start()
+    outcome = 'ok'
+    try:
+        yield extra
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        samples = profiler.stop()
+        try:
+            saved = store.save(samples, dict(
+                metadata, **extra,
+                started_at=started,
+                elapsed_seconds=round(time.time() - started, 3),
+                interval_seconds=profiler.interval,
+                outcome=outcome
+            ))
+            print(f"🔬 Profile saved: {saved['id']} ({saved['samples']} samples)")
+        except Exception as e:
+            print(f"⚠️ Could not save profile: {e}")
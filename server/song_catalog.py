@@ -0,0 +1,238 @@
+"""
+Curated catalog of verified chord timelines, checked before any download
+
+The catalog is a JSON file of songs whose chord timelines were checked by
+hand against the recording:
+
+    {"songs": [{"title": "...", "artist": "...", "video_ids": ["..."],
+                "duration": 258, "key": "Em", "bpm": 138,
+                "chords": [{"chord": "Em", "time": 0.0}, {"chord": "C", "time": 8.7}]}]}
+
+Entries without timed chords are ignored. The file ships empty; curated
+songs are answered ahead of any analysis, so only add timelines that are
+actually verified. Lookups happen by video ID and by title, both from the
+request and from the video title yt-dlp reports before downloading.
+
+A timeline belongs to one recording, so title matches are strict: a live,
+cover, acoustic, remix, karaoke or instrumental version only matches an
+entry that names the same qualifier, a title shared by several entries
+matches none of them, and when the video duration is known (extracted
+metadata) it must agree with the entry's duration.
+
+The catalog is loaded into an immutable snapshot with hash maps from video
+ID and from normalized "artist title" / "title" keys, plus a token index for
+titles with extra words such as "(Official Video)". Each entry is posted
+only under its rarest title word, so lookups are O(1) for IDs and exact
+titles and O(k) in the number of query tokens otherwise, no matter how
+common words like "love" are.
+
+The file is re-read when its mtime changes (checked at most every
+CATALOG_RELOAD_SECONDS), so edits go live in every worker without a restart.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+CATALOG_PATH = os.environ.get(
+    'CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog', 'songs.json')
+)
+CATALOG_RELOAD_SECONDS = float(os.environ.get('CATALOG_RELOAD_SECONDS', 5))
+# How far a video's length may be from the curated recording's for a title match
+CATALOG_DURATION_TOLERANCE_SECONDS = float(os.environ.get('CATALOG_DURATION_TOLERANCE_SECONDS', 4))
+
+# Words YouTube titles add around the actual song title
+NOISE_TOKENS = {
+    'official', 'video', 'music', 'audio', 'lyric', 'lyrics', 'hd', 'hq', '4k', 'remastered',
+    'remaster', 'version', 'mv', 'visualizer', 'the'
+}
+# Words that mark a different recording of the song, not just title decoration
+VERSION_QUALIFIERS = {
+    'live', 'cover', 'acoustic', 'remix', 'karaoke', 'instrumental', 'unplugged', 'piano',
+    'guitar', 'demo', 'edit', 'mix', 'slowed', 'sped', 'nightcore', 'reverb', 'medley', 'mashup'
+}
+_BRACKETED = re.compile(r'[\(\[\{][^\)\]\}]*[\)\]\}]')
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_tokens(text):
+    """Lowercase, accent-free tokens without bracketed parts or title noise words"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    text = _BRACKETED.sub(' ', text)
+    text = re.sub(r'\b(ft|feat|featuring)\b.*$', ' ', text)
+    return [t for t in _NON_WORD.split(text) if t and t not in NOISE_TOKENS]
+
+
+def version_qualifiers(title):
+    """Recording qualifiers anywhere in a title, bracketed parts included"""
+    text = unicodedata.normalize('NFKD', title or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return frozenset(t for t in _NON_WORD.split(text) if t in VERSION_QUALIFIERS)
+
+
+def title_key(title, artist=None):
+    return ' '.join(normalize_tokens(artist) + normalize_tokens(title)) if artist else ' '.join(normalize_tokens(title))
+
+
+def entry_chords(entry):
+    """Timed chords of an entry, in time order"""
+    return sorted(({
+        'chord': c['chord'],
+        'time': float(c['time']),
+        'confidence': float(c.get('confidence', 1.0))
+    } for c in entry.get('chords') or []), key=lambda c: c['time'])
+
+
+def catalog_key(entry):
+    """Song key for an entry: its first video ID, else a key derived from the title"""
+    if entry.get('video_ids'):
+        return entry['video_ids'][0]
+    return 'catalog-' + title_key(entry['title'], entry.get('artist')).replace(' ', '-')
+
+
+class _CatalogSnapshot:
+    """Immutable lookup tables built from one version of the catalog file"""
+
+    def __init__(self, entries):
+        # Only timed chords are a usable answer
+        entries = [e for e in entries if e.get('chords') and e.get('title')]
+        self.entries = entries
+        self.by_video_id = {}
+        self.by_catalog_key = {}
+        self.by_key = defaultdict(list)
+        self.anchor_postings = defaultdict(list)
+        self.title_tokens = [frozenset(normalize_tokens(e['title'])) for e in entries]
+        self.qualifiers = [version_qualifiers(e['title']) for e in entries]
+
+        frequency = Counter(token for tokens in self.title_tokens for token in tokens)
+        for i, entry in enumerate(entries):
+            for video_id in entry.get('video_ids', []):
+                self.by_video_id[video_id] = i
+            self.by_catalog_key[catalog_key(entry)] = i
+            for key in {title_key(entry['title'], entry.get('artist')), title_key(entry['title'])}:
+                self.by_key[key].append(i)
+            if self.title_tokens[i]:
+                anchor = min(self.title_tokens[i], key=lambda token: (frequency[token], token))
+                self.anchor_postings[anchor].append(i)
+
+    def _artist_compatible(self, i, artist_tokens):
+        """An entry and a query that both name an artist must name the same one"""
+        entry_artist = set(normalize_tokens(self.entries[i].get('artist')))
+        return not (entry_artist and artist_tokens) or entry_artist <= artist_tokens
+
+    def _same_recording(self, i, qualifiers, duration):
+        if self.qualifiers[i] != qualifiers:
+            return False
+        if duration is None:
+            return True
+        entry_duration = self.entries[i].get('duration')
+        return entry_duration is not None and abs(entry_duration - duration) <= CATALOG_DURATION_TOLERANCE_SECONDS
+
+    def find_by_title(self, title, artist=None, duration=None):
+        if not artist and ' - ' in (title or ''):
+            # YouTube convention: "Artist - Title"
+            artist, title = title.split(' - ', 1)
+        artist_tokens = set(normalize_tokens(artist))
+        qualifiers = version_qualifiers(title)
+
+        for key in (title_key(title, artist), title_key(title)):
+            if not key or key not in self.by_key:
+                continue
+            # A title several entries share names none of them
+            matches = [i for i in self.by_key[key] if self._artist_compatible(i, artist_tokens)]
+            if len(matches) > 1:
+                return None
+            if matches:
+                return matches[0] if self._same_recording(matches[0], qualifiers, duration) else None
+
+        # Titles with extra words only match when both sides name the same artist;
+        # otherwise "It's the Beat" would find "Beat It"
+        if not artist_tokens:
+            return None
+        query_tokens = set(normalize_tokens(title)) | artist_tokens
+        candidates = [
+            i
+            for token in query_tokens
+            for i in self.anchor_postings.get(token, ())
+            if self.title_tokens[i] <= query_tokens
+            and self.entries[i].get('artist')
+            and self._artist_compatible(i, artist_tokens)
+        ]
+        if not candidates:
+            return None
+        best = max(candidates, key=lambda i: len(self.title_tokens[i]))
+        return best if self._same_recording(best, qualifiers, duration) else None
+
+
+class SongCatalog:
+    """Hot-reloadable catalog; lookups always see one consistent snapshot"""
+
+    def __init__(self, path=CATALOG_PATH, reload_seconds=CATALOG_RELOAD_SECONDS, on_change=None):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        # Called with the new entries after every swap, e.g. to refresh search indexes
+        self.on_change = on_change
+        self._snapshot = _CatalogSnapshot([])
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def __len__(self):
+        return len(self._snapshot.entries)
+
+    def reload(self, force=False):
+        """Rebuild the snapshot if the file changed; returns True when a new one was swapped in"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime and not force:
+                return False
+            try:
+                entries = []
+                if mtime is not None:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    entries = data.get('songs', []) if isinstance(data, dict) else data
+                snapshot = _CatalogSnapshot(entries)
+            except Exception as e:
+                # Keep serving the previous catalog rather than an empty or half-parsed one
+                print(f"⚠️ Catalog reload failed, keeping {len(self._snapshot.entries)} songs: {e}")
+                self._mtime = mtime
+                return False
+            self._snapshot = snapshot
+            self._mtime = mtime
+        print(f"📚 Catalog loaded: {len(snapshot.entries)} songs from {self.path}")
+        if self.on_change:
+            self.on_change(snapshot.entries)
+        return True
+
+    def _current(self):
+        if time.monotonic() - self._checked_at >= self.reload_seconds:
+            self.reload()
+        return self._snapshot
+
+    def lookup(self, video_id=None, title=None, artist=None, duration=None):
+        """
+        Catalog entry for a video ID or title, or None. Pass the video's
+        duration when it is known so title matches must agree with it.
+        """
+        snapshot = self._current()
+        i = snapshot.by_video_id.get(video_id) if video_id else None
+        if i is None and title:
+            i = snapshot.find_by_title(title, artist, duration)
+        return snapshot.entries[i] if i is not None else None
+
+    def get(self, key):
+        """Entry stored under a catalog_key() or any of its video IDs, or None"""
+        snapshot = self._current()
+        i = snapshot.by_catalog_key.get(key)
+        if i is None:
+            i = snapshot.by_video_id.get(key)
+        return snapshot.entries[i] if i is not None else None